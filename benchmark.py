@@ -0,0 +1,200 @@
+import gc
+import json
+import math
+import os
+import sys
+import tempfile
+
+import powerpoint_to_graphviz
+from generate_odp import generate_odp
+
+
+# Runs the full conversion over synthetic diagrams of increasing size and reports the time (and optionally the peak
+# memory) taken by each step. The results can be saved as a baseline and later runs compared against it, so that
+# a step which has become slower, or which has started to grow faster than linearly with the size of the diagram,
+# is caught automatically.
+
+
+# Stages that take less time than this are too noisy to compare against a baseline
+MINIMUM_COMPARABLE_SECONDS = 0.005
+
+
+# Return the numbers of VMs, ports and networks to generate for a diagram of the given size. The size is the number
+# of ports; each VM has four ports and each network joins three of them
+def diagram_for_size(size):
+    return {
+        'vms': max(1, size // 4),
+        'ports': size,
+        'networks': max(1, size // 3)
+    }
+
+
+# Convert the given file once, returning its stats. Garbage left over from earlier runs is collected first so that
+# it isn't charged to this one
+def convert_once(file_name, streaming_ingest, trace_memory):
+    gc.collect()
+    stats = powerpoint_to_graphviz.conversion_stats(trace_memory=trace_memory)
+    try:
+        powerpoint_to_graphviz.convert(file_name, streaming_ingest=streaming_ingest, stats=stats)
+    finally:
+        stats.close()
+
+    return stats.as_dict()
+
+
+# Convert the given file, returning the stats of the fastest of the repeated runs. Tracing memory slows the
+# conversion down a great deal, so when memory is wanted it is measured by a separate run and the peaks are
+# added to the timings of the fastest untraced run
+def time_conversion(file_name, repeat, streaming_ingest, trace_memory):
+    best = None
+    for _ in range(repeat):
+        result = convert_once(file_name, streaming_ingest, trace_memory=False)
+        if best is None or result['total_seconds'] < best['total_seconds']:
+            best = result
+
+    if trace_memory:
+        traced = convert_once(file_name, streaming_ingest, trace_memory=True)
+        peaks = {stage['stage']: stage['peak_bytes'] for stage in traced['stages']}
+        for stage in best['stages']:
+            stage['peak_bytes'] = peaks.get(stage['stage'])
+
+    return best
+
+
+# Generate and convert a diagram of each of the given sizes, returning the results of each run
+def run_sweep(sizes, repeat=3, streaming_ingest=True, trace_memory=False):
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            file_name = os.path.join(work_dir, f"synthetic_{size}.odp")
+            counts = generate_odp(file_name, **diagram_for_size(size))
+            result = time_conversion(file_name, repeat, streaming_ingest, trace_memory)
+            result['size'] = size
+            result['file_bytes'] = os.path.getsize(file_name)
+            result['generated'] = counts
+            results.append(result)
+
+    return results
+
+
+# Return how fast the time taken by each stage grows with the size of the diagram, as the exponent k in
+# time ~ size^k measured between the two largest sizes. Linear steps come out at around 1, quadratic ones at 2
+def growth_exponents(results):
+    if len(results) < 2:
+        return {}
+
+    smaller, larger = results[-2], results[-1]
+    smaller_stages = {stage['stage']: stage['seconds'] for stage in smaller['stages']}
+    smaller_stages['total'] = smaller['total_seconds']
+    larger_stages = {stage['stage']: stage['seconds'] for stage in larger['stages']}
+    larger_stages['total'] = larger['total_seconds']
+
+    exponents = {}
+    for name, seconds in larger_stages.items():
+        if name in smaller_stages and seconds >= MINIMUM_COMPARABLE_SECONDS and smaller_stages[name] > 0:
+            exponents[name] = math.log(seconds / smaller_stages[name]) / math.log(larger['size'] / smaller['size'])
+
+    return exponents
+
+
+# Compare the results with a baseline run of the same sizes. Returns a list of descriptions of every stage that
+# has become slower than the baseline by more than the given factor
+def compare_with_baseline(results, baseline, tolerance):
+    baseline_by_size = {result['size']: result for result in baseline['results']}
+
+    regressions = []
+    for result in results:
+        previous = baseline_by_size.get(result['size'])
+        if previous is None:
+            continue
+
+        previous_stages = {stage['stage']: stage['seconds'] for stage in previous['stages']}
+        for stage in result['stages']:
+            before = previous_stages.get(stage['stage'])
+            if before is None or max(before, stage['seconds']) < MINIMUM_COMPARABLE_SECONDS:
+                continue
+            if stage['seconds'] > before * tolerance:
+                regressions.append(f"size {result['size']}: {stage['stage']} took {stage['seconds']:.4f}s, "
+                                   f"baseline {before:.4f}s ({stage['seconds'] / before:.1f}x)")
+
+    return regressions
+
+
+# Return the results as a human-readable table, one row per size and one column per stage
+def format_results(results):
+    stage_names = []
+    for result in results:
+        for stage in result['stages']:
+            if stage['stage'] not in stage_names:
+                stage_names.append(stage['stage'])
+
+    lines = [f"{'size':>8}{'shapes':>9}" + "".join(f"{name:>18}" for name in stage_names) + f"{'total':>12}"]
+    for result in results:
+        stages = {stage['stage']: stage for stage in result['stages']}
+        line = f"{result['size']:>8}{result['counters']['shapes']:>9}"
+        for name in stage_names:
+            stage = stages.get(name)
+            cell = ""
+            if stage is not None:
+                cell = f"{stage['seconds']:.4f}s"
+                if stage['peak_bytes'] is not None:
+                    cell += f"/{stage['peak_bytes'] / 1048576:.1f}M"
+            line += f"{cell:>18}"
+        lines.append(line + f"{result['total_seconds']:>11.4f}s")
+
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the converter over synthetic diagrams of increasing size")
+    parser.add_argument("--sizes", default="1000,3000,10000,30000",
+                        help="comma separated diagram sizes, in ports (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="conversions per size; the fastest is reported (default: %(default)s)")
+    parser.add_argument("--no-streaming", dest="streaming_ingest", action="store_false",
+                        help="benchmark the in-memory reader instead of the streaming one")
+    parser.add_argument("--memory", action="store_true",
+                        help="also record the peak memory of each step (slows the conversion down)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--save-baseline", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="how many times slower than the baseline a step may be (default: %(default)s)")
+    parser.add_argument("--max-exponent", type=float, default=1.75,
+                        help="the fastest growth with size allowed for any step, as the k in time ~ size^k "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    results = run_sweep(sizes, args.repeat, args.streaming_ingest, args.memory)
+    exponents = growth_exponents(results)
+
+    if args.json:
+        print(json.dumps({'results': results, 'growth_exponents': exponents}, indent=2))
+    else:
+        print(format_results(results))
+        for name, exponent in exponents.items():
+            print(f"growth of {name}: size^{exponent:.2f}")
+
+    failures = [f"{name} grows as size^{exponent:.2f}, more than size^{args.max_exponent}"
+                for name, exponent in exponents.items() if exponent > args.max_exponent]
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            failures += compare_with_baseline(results, json.load(baseline_file), args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "wt") as baseline_file:
+            json.dump({'sizes': sizes, 'streaming_ingest': args.streaming_ingest, 'results': results},
+                      baseline_file, indent=2)
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
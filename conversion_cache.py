@@ -0,0 +1,149 @@
+import hashlib
+import os
+from zipfile import ZipFile
+
+
+# An on-disk cache of converted .dot files, so that presentations which haven't changed since they were last
+# converted don't have to be decompressed and parsed again. Entries are keyed on the CRC32 and size of the
+# content.xml member of the presentation, both of which are read from the zip directory without decompressing
+# anything, along with the converter version and any options that change the output. The cache is kept below a
+# maximum size by evicting the least recently used entries. Entries are written atomically, so several processes
+# can share one cache.
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+# Return the default cache directory, following the XDG convention
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "odf_to_graphviz")
+
+
+class conversion_cache:
+
+    # The file name extension of the entries
+    suffix = ".dot"
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory if directory is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cache key for an ODF file (a file name or binary file object) converted by the given version of
+    # the converter with the given options
+    def key_for(self, odf_file, version, options=()):
+        with ZipFile(odf_file, 'r') as zip:
+            info = zip.getinfo("content.xml")
+
+        if hasattr(odf_file, "seek"):
+            odf_file.seek(0)
+
+        key_text = f"{version}|{info.CRC:08x}|{info.file_size}|{'|'.join(str(option) for option in options)}"
+        return hashlib.sha256(key_text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    # Return the .dot text stored under the key, or None if there isn't any. A hit marks the entry as recently used
+    def get(self, key):
+        from io import StringIO
+
+        sink = StringIO()
+        return sink.getvalue() if self.copy_to(key, sink) else None
+
+    # Copy the .dot text stored under the key to a text sink, a block at a time, and return True. Returns False if
+    # there isn't an entry for the key. A hit marks the entry as recently used
+    def copy_to(self, key, sink, block_size=1 << 16):
+        path = self._path(key)
+        try:
+            cached_file = open(path, "rt", encoding="utf-8")
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        with cached_file:
+            while True:
+                block = cached_file.read(block_size)
+                if not block:
+                    break
+                sink.write(block)
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return True
+
+    # Store the .dot text under the key
+    def put(self, key, result):
+        with self.open_entry(key) as entry:
+            entry.write(result)
+
+    # Return a text file to write a new entry for the key into, for use in a with statement. The entry only appears
+    # in the cache once the with statement completes without an error, and old entries are then evicted if the cache
+    # has grown too large
+    def open_entry(self, key):
+        return _cache_entry(self, key)
+
+    # Remove the least recently used entries until the cache is within its maximum size
+    def evict(self):
+        entries = []
+        total_bytes = 0
+        for entry in self._entries():
+            try:
+                status = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime, status.st_size, entry.path))
+            total_bytes += status.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    # Remove every entry from the cache
+    def clear(self):
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                return [entry for entry in entries if entry.is_file() and entry.name.endswith(self.suffix)]
+        except FileNotFoundError:
+            return []
+
+
+# A new cache entry being written. It is written to a temporary file which replaces the entry when complete
+class _cache_entry:
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._path = cache._path(key)
+        self._temp_path = f"{self._path}.{os.getpid()}.{id(self)}.tmp"
+
+    def __enter__(self):
+        os.makedirs(self._cache.directory, exist_ok=True)
+        self._file = open(self._temp_path, "wt", encoding="utf-8")
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._temp_path, self._path)
+            self._cache.evict()
+        else:
+            os.remove(self._temp_path)
+        return False
@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+from collections import OrderedDict
+from time import perf_counter
+
+import powerpoint_to_graphviz as converter
+
+
+# A small HTTP service that converts presentations on demand, so that a portal doesn't have to start a new Python
+# process for every conversion. It uses nothing but the standard library:
+#
+#   POST /convert   the body is the .odp file; the response is the text of the .dot file. The conversion options
+#                   can be given as query parameters: all_pages, merge_networks, clusters (true or false), focus
+#                   and hops, as on the command line
+#   GET  /health    reports that the service is up
+#   GET  /metrics   reports counts of requests, conversions and cache hits, and the time spent converting, as JSON
+#
+# Conversions run in a bounded pool of worker processes (or threads), and the results of recent conversions are kept
+# in memory, keyed on a hash of the uploaded file and the options, so a presentation uploaded again is answered
+# straight away. Identical conversions that arrive together are only run once. When more conversions are being
+# uploaded or waiting than the pool can keep up with, new ones are turned away with 503 Service Unavailable before
+# their uploads are read, rather than queued without limit, and uploads larger than the limit are refused with 413
+# Payload Too Large, so the memory taken by uploads is bounded.
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+DEFAULT_MAX_PENDING = 16
+DEFAULT_MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+DEFAULT_CACHE_ENTRIES = 128
+REQUEST_TIMEOUT_SECONDS = 30
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+           411: "Length Required", 413: "Payload Too Large", 422: "Unprocessable Entity",
+           503: "Service Unavailable"}
+
+BOOLEAN_OPTIONS = ("all_pages", "merge_networks", "clusters")
+
+
+# Raised while handling a request to send an error response with the given status
+class http_error(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Convert an uploaded presentation, given as bytes, and return the text of the .dot file. This runs in the worker
+# pool, so it only takes and returns simple values
+def convert_uploaded(data, options):
+    from io import BytesIO
+
+    return converter.convert(BytesIO(data), **options)
+
+
+# Return the conversion options given as query parameters
+def options_from_query(query):
+    from urllib.parse import parse_qs
+
+    options = {}
+    for name, values in parse_qs(query, keep_blank_values=True).items():
+        value = values[-1]
+        if name in BOOLEAN_OPTIONS:
+            if value.lower() not in ("true", "false", "1", "0", "yes", "no"):
+                raise http_error(400, f"{name} must be true or false")
+            options[name] = value.lower() in ("true", "1", "yes")
+        elif name == "focus":
+            options[name] = value
+        elif name == "hops":
+            try:
+                options[name] = int(value)
+            except ValueError:
+                raise http_error(400, "hops must be a whole number")
+        else:
+            raise http_error(400, f"Unknown option {name}")
+
+    return options
+
+
+# A least recently used cache of .dot text held in memory, limited to a number of entries
+class result_cache:
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the result stored under the key, or None if there isn't one
+    def get(self, key):
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+
+        self._results.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def __len__(self):
+        return len(self._results)
+
+
+class conversion_server:
+
+    def __init__(self, executor, max_pending=DEFAULT_MAX_PENDING, max_upload_bytes=DEFAULT_MAX_UPLOAD_BYTES,
+                 cache_entries=DEFAULT_CACHE_ENTRIES):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.max_upload_bytes = max_upload_bytes
+        self.cache = result_cache(cache_entries)
+        self.started = perf_counter()
+
+        # The conversions running or waiting for a worker, keyed on the same key as the cache
+        self._pending = {}
+
+        # The number of conversion requests whose uploads are being read or held until they have been answered
+        self._uploads = 0
+
+        self.counters = {'requests': 0, 'conversions': 0, 'failed_conversions': 0, 'rejected': 0,
+                         'errors': 0, 'converting_seconds': 0.0}
+
+    # Return the .dot text for an uploaded presentation, from the cache, from an identical conversion already under
+    # way, or from a new conversion in the pool
+    async def convert(self, data, options):
+        digest = hashlib.sha256(data)
+        digest.update("|".join(converter.output_options(options)).encode("utf-8"))
+        key = digest.hexdigest()
+
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        pending = self._pending.get(key)
+        if pending is None:
+            if len(self._pending) >= self.max_pending:
+                self.counters['rejected'] += 1
+                raise http_error(503, "Too many conversions waiting, try again later")
+
+            pending = asyncio.ensure_future(self._run_conversion(key, data, options))
+            self._pending[key] = pending
+
+        return await asyncio.shield(pending)
+
+    async def _run_conversion(self, key, data, options):
+        started = perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, convert_uploaded, data,
+                                                                       options)
+        except Exception as e:
+            self.counters['failed_conversions'] += 1
+            raise http_error(422, f"Failed to convert the presentation: {e}")
+        finally:
+            del self._pending[key]
+            self.counters['converting_seconds'] += perf_counter() - started
+
+        self.counters['conversions'] += 1
+        self.cache.put(key, result)
+        return result
+
+    # Return the metrics reported by /metrics
+    def metrics(self):
+        return dict(self.counters, pending=len(self._pending), uploads=self._uploads, max_pending=self.max_pending,
+                    cache_entries=len(self.cache), cache_hits=self.cache.hits, cache_misses=self.cache.misses,
+                    uptime_seconds=perf_counter() - self.started)
+
+    # Handle one connection, which carries a single request
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                status, content_type, body = await self.handle_request(reader)
+            except http_error as e:
+                status, content_type, body = e.status, "text/plain; charset=utf-8", str(e) + "\n"
+            except asyncio.TimeoutError:
+                status, content_type, body = 408, "text/plain; charset=utf-8", "Request timed out\n"
+            except Exception as e:
+                logger.exception("Error handling a request")
+                self.counters['errors'] += 1
+                status, content_type, body = 400, "text/plain; charset=utf-8", f"{e}\n"
+
+            body = body.encode("utf-8")
+            headers = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                       f"Content-Type: {content_type}",
+                       f"Content-Length: {len(body)}",
+                       "Connection: close"]
+            if status == 503:
+                headers.append("Retry-After: 1")
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Read a request and return the status, content type and body of the response. The request has to arrive within
+    # the time limit, but the conversion may take as long as it needs
+    async def handle_request(self, reader):
+        method, url, headers = await asyncio.wait_for(self.read_request_head(reader), REQUEST_TIMEOUT_SECONDS)
+        self.counters['requests'] += 1
+
+        if url.path == "/health":
+            if method != "GET":
+                raise http_error(405, "Use GET")
+            return 200, "application/json", json.dumps({'status': "ok", 'version': converter.__version__}) + "\n"
+
+        if url.path == "/metrics":
+            if method != "GET":
+                raise http_error(405, "Use GET")
+            return 200, "application/json", json.dumps(self.metrics(), indent=2) + "\n"
+
+        if url.path != "/convert":
+            raise http_error(404, "Not found")
+        if method != "POST":
+            raise http_error(405, "Use POST")
+
+        if "content-length" not in headers:
+            raise http_error(411, "Content-Length is required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise http_error(400, "Malformed Content-Length")
+        if length > self.max_upload_bytes:
+            raise http_error(413, f"Uploads are limited to {self.max_upload_bytes} bytes")
+
+        options = options_from_query(url.query)
+
+        # Turn the request away before reading its upload if there are already as many as can be waiting, so that
+        # an overloaded server doesn't hold on to uploads it can't convert
+        if self._uploads >= self.max_pending:
+            self.counters['rejected'] += 1
+            raise http_error(503, "Too many conversions waiting, try again later")
+
+        self._uploads += 1
+        try:
+            data = await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT_SECONDS)
+            return 200, "text/vnd.graphviz; charset=utf-8", await self.convert(data, options)
+        finally:
+            self._uploads -= 1
+
+    # Read the request line and headers of a request, returning the method, the split URL and the headers, with
+    # their names in lower case
+    async def read_request_head(self, reader):
+        from urllib.parse import urlsplit
+
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise http_error(400, "Empty request")
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise http_error(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        return method, urlsplit(target), headers
+
+
+# Run the server until it is interrupted
+async def serve(host, port, executor, **limits):
+    server = conversion_server(executor, **limits)
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+
+    addresses = ", ".join(f"{address[0]}:{address[1]}" for address in
+                          (socket.getsockname() for socket in listener.sockets))
+    sys.stderr.write(f"Serving conversions on {addresses}\n")
+
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Serve conversions of ODF presentations to graphviz (.dot) "
+                                                 "specifications over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of conversions to run at once (default: one per CPU)")
+    parser.add_argument("--threads", action="store_true",
+                        help="convert in a pool of threads instead of worker processes")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="most conversions being uploaded, running or waiting at once; more are turned away "
+                             "with 503 (default: %(default)s)")
+    parser.add_argument("--max-upload", type=float, default=DEFAULT_MAX_UPLOAD_BYTES / (1024 * 1024),
+                        help="largest upload accepted, in MiB (default: %(default)s)")
+    parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES,
+                        help="number of recent results kept in memory (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="report the steps of each conversion")
+    args = parser.parse_args(argv)
+
+    log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
+    logging.basicConfig(level=log_levels[min(args.verbose, len(log_levels) - 1)], format="%(message)s")
+
+    executor = ThreadPoolExecutor(args.jobs) if args.threads else ProcessPoolExecutor(args.jobs)
+    with executor:
+        try:
+            asyncio.run(serve(args.host, args.port, executor, max_pending=args.max_pending,
+                              max_upload_bytes=int(args.max_upload * 1024 * 1024), cache_entries=args.cache_entries))
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
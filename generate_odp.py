@@ -0,0 +1,169 @@
+import sys
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+
+# Generates synthetic network diagrams, saved as open document format (ODF) presentations laid out in the same way
+# as the ones saved from PowerPoint, for testing and benchmarking the converter at sizes well beyond the hand-drawn
+# examples. Each shape carries a label of comma separated name=value pairs, one per paragraph, in the same way as
+# the drawn diagrams do:
+#
+#   - every VM is a shape labelled type=vm and name=vmN
+#   - every port is a shape labelled type=port and name=portN, joined to one of the VMs by a connector
+#   - every network is a shape labelled type=net and name=netN
+#   - each network connector joins a port to a network. Ports are attached to the networks in turn, so with the
+#     default of one network connector per port, the ports are spread evenly across the networks
+
+
+ODF_PRESENTATION_MIMETYPE = "application/vnd.oasis.opendocument.presentation"
+
+ODF_NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" '
+    'xmlns:presentation="urn:oasis:names:tc:opendocument:xmlns:presentation:1.0"'
+)
+
+MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    f'<manifest:file-entry manifest:full-path="/" manifest:version="1.2" manifest:media-type="{ODF_PRESENTATION_MIMETYPE}"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>'
+    '</manifest:manifest>'
+)
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    f'<office:document-styles {ODF_NAMESPACES} office:version="1.2"/>'
+)
+
+
+# Return the XML for a custom shape with the given ID, whose label is made up of the given name=value pairs. As in
+# the files saved from PowerPoint, each pair is a separate paragraph and all but the last end in a comma
+def shape_xml(shape_id, properties, x, y):
+    paragraphs = ""
+    for index, (name, value) in enumerate(properties):
+        separator = "," if index < len(properties) - 1 else ""
+        paragraphs += f'<text:p><text:span>{name}={value}{separator}</text:span></text:p>'
+
+    return (f'<draw:custom-shape draw:id="{shape_id}" svg:width="4cm" svg:height="2cm" '
+            f'svg:x="{x}cm" svg:y="{y}cm">{paragraphs}</draw:custom-shape>')
+
+
+# Return the XML for a connector joining two shapes
+def connector_xml(connector_id, start_shape, end_shape):
+    return f'<draw:connector draw:id="{connector_id}" draw:start-shape="{start_shape}" draw:end-shape="{end_shape}"/>'
+
+
+# Collects text in memory and writes it to a binary stream in large UTF-8 encoded blocks
+class _buffered_text_writer:
+
+    def __init__(self, stream, buffer_size=1 << 16):
+        self._stream = stream
+        self._buffer_size = buffer_size
+        self._pieces = []
+        self._length = 0
+
+    def write(self, text):
+        self._pieces.append(text)
+        self._length += len(text)
+        if self._length >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        self._stream.write("".join(self._pieces).encode("utf-8"))
+        self._pieces = []
+        self._length = 0
+
+
+# Write a synthetic ODF presentation with the given numbers of VMs, ports and networks to the named file. By
+# default every port is attached to one network; network_connectors can be used to attach more (or fewer) ports.
+# The content is written straight into the zip file as it is generated, so very large diagrams can be produced
+# without holding them in memory. Returns a dictionary of the numbers of each kind of object written
+def generate_odp(file_name, vms, ports, networks, network_connectors=None):
+
+    if vms < 1 and ports > 0:
+        raise Exception("Ports need at least one VM to belong to")
+    if networks < 1 and network_connectors:
+        raise Exception("Network connectors need at least one network to attach to")
+    if network_connectors is None:
+        network_connectors = ports if networks > 0 else 0
+    if ports < 1 and network_connectors > 0:
+        raise Exception("Network connectors need at least one port to attach")
+
+    next_id = 0
+
+    def new_id():
+        nonlocal next_id
+        next_id += 1
+        return f"id{next_id}"
+
+    with ZipFile(file_name, 'w', ZIP_DEFLATED) as zip:
+        # The mimetype must come first and be stored uncompressed
+        zip.writestr("mimetype", ODF_PRESENTATION_MIMETYPE, compress_type=ZIP_STORED)
+        zip.writestr("META-INF/manifest.xml", MANIFEST)
+        zip.writestr("styles.xml", STYLES)
+
+        with zip.open("content.xml", 'w', force_zip64=True) as raw_content:
+            content = _buffered_text_writer(raw_content)
+            content.write(f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                          f'<office:document-content {ODF_NAMESPACES} office:version="1.2">'
+                          f'<office:body><office:presentation><draw:page draw:name="page1">')
+
+            vm_ids = []
+            for vm in range(vms):
+                vm_ids.append(new_id())
+                content.write(shape_xml(vm_ids[-1], [("type", "vm"), ("name", f"vm{vm + 1}")], vm % 50, vm // 50))
+
+            network_ids = []
+            for network in range(networks):
+                network_ids.append(new_id())
+                content.write(shape_xml(network_ids[-1], [("type", "net"), ("name", f"net{network + 1}")],
+                                        network % 50, 200 + network // 50))
+
+            # Ports are shared out between the VMs in turn, each one joined to its VM by a connector
+            port_ids = []
+            for port in range(ports):
+                port_ids.append(new_id())
+                content.write(shape_xml(port_ids[-1], [("type", "port"), ("name", f"port{port + 1}"),
+                                                       ("num", port // vms + 1)], port % 50, 100 + port // 50))
+                content.write(connector_xml(new_id(), vm_ids[port % vms], port_ids[-1]))
+
+            # Then the ports are attached to the networks in turn
+            for connector in range(network_connectors):
+                content.write(connector_xml(new_id(), port_ids[connector % ports],
+                                            network_ids[connector % networks]))
+
+            content.write('</draw:page></office:presentation></office:body></office:document-content>')
+            content.flush()
+
+    return {
+        'vms': vms,
+        'ports': ports,
+        'networks': networks,
+        'shapes': vms + ports + networks,
+        'connectors': ports + network_connectors
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic network diagram as an ODF presentation")
+    parser.add_argument("output", help="the .odp file to write")
+    parser.add_argument("--vms", type=int, default=10, help="number of VMs (default: %(default)s)")
+    parser.add_argument("--ports", type=int, default=30, help="number of ports (default: %(default)s)")
+    parser.add_argument("--networks", type=int, default=10, help="number of networks (default: %(default)s)")
+    parser.add_argument("--network-connectors", type=int, default=None,
+                        help="number of port to network connectors (default: one per port)")
+    args = parser.parse_args(argv)
+
+    counts = generate_odp(args.output, args.vms, args.ports, args.networks, args.network_connectors)
+    print(", ".join(f"{count} {name}" for name, count in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import sys
+from array import array
+
+
+# A compact, array-backed form of a scanned network diagram. The converter holds every shape and connector as a
+# dictionary with string keys, which is convenient but costs several hundred bytes per object. Here every string
+# (IDs, labels, property names and values) is stored once in a table of interned strings, and the shapes, connectors
+# and networks are parallel arrays of 32-bit indexes into it, or into each other:
+#
+#   - shape i has the ID strings[shape_ids[i]], label strings[shape_labels[i]], name strings[shape_names[i]] and
+#     type strings[shape_types[i]] (-1 where the label doesn't give a name or type). Its properties are the name=value
+#     pairs strings[property_names[j]]=strings[property_values[j]] for j from property_offsets[i] up to
+#     property_offsets[i + 1]
+#   - connector i has the ID strings[connector_ids[i]] and joins shapes connector_sources[i] and
+#     connector_destinations[i] (-1 where an end isn't attached to a shape in the diagram, in which case the ID it
+#     refers to is kept in connector_source_refs or connector_destination_refs)
+#   - network i is drawn by shape network_shapes[i], and has the ports network_ports[j] for j from
+#     network_port_offsets[i] up to network_port_offsets[i + 1]. When networks have been merged, the shapes it was
+#     merged from are network_members[j] for j from network_member_offsets[i] up to network_member_offsets[i + 1]
+#
+# The connections between shapes are also available in compressed sparse row (CSR) form: the neighbours of shape i
+# are adjacency_targets[j] for j from adjacency_offsets[i] up to adjacency_offsets[i + 1]. Every array is an
+# array.array of signed 32-bit integers, so numerical tools can use them in place, for example with
+# numpy.frombuffer(graph.adjacency_targets, dtype=numpy.int32), without this module depending on them.
+#
+# The converter is only imported by the methods that scan a diagram or work out its networks, so that a graph can be
+# loaded from a snapshot by the converter, run as a script, without the converter being imported a second time.
+
+
+# The type code used for all of the index arrays
+INDEX_TYPE = 'i'
+
+# The names of the index arrays, in the order they are stored in a snapshot
+ARRAY_NAMES = ("shape_ids", "shape_labels", "shape_names", "shape_types",
+               "property_offsets", "property_names", "property_values",
+               "connector_ids", "connector_sources", "connector_destinations",
+               "connector_source_refs", "connector_destination_refs",
+               "network_shapes", "network_port_offsets", "network_ports",
+               "network_member_offsets", "network_members",
+               "adjacency_offsets", "adjacency_targets")
+
+
+class compact_graph:
+
+    def __init__(self):
+        self.strings = []
+        self._string_index = {}
+        self._shape_index = {}
+
+        for name in ARRAY_NAMES:
+            setattr(self, name, array(INDEX_TYPE))
+        self.property_offsets.append(0)
+        self.network_port_offsets.append(0)
+        self.network_member_offsets.append(0)
+
+        # Whether networks with the same name (or joined to each other) have been merged into one
+        self.merged_networks = True
+
+    # Return the index of a string in the string table, adding it if it isn't there yet. None is stored as -1
+    def intern(self, text):
+        if text is None:
+            return -1
+
+        if self._string_index is None:
+            self._string_index = {text: index for index, text in enumerate(self.strings)}
+
+        index = self._string_index.get(text)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(sys.intern(text))
+            self._string_index[text] = index
+        return index
+
+    # Return the string at an index in the string table, or None for -1
+    def string(self, index):
+        return self.strings[index] if index >= 0 else None
+
+    # Add a shape, given its draw:id and label. The label is parsed into its properties here, once
+    def add_shape(self, shape_id, label, properties=None):
+        import powerpoint_to_graphviz as converter
+
+        if shape_id is None:
+            raise Exception(f"Shape labelled {converter.tidy_text(label)!r} has no draw:id")
+        if self.shape_index(shape_id) >= 0:
+            raise Exception(f"can't have more than one shape with the id {shape_id}")
+
+        if properties is None:
+            properties = converter.get_object_properties_from_label(label)
+
+        self._shape_index[shape_id] = len(self.shape_ids)
+        self.shape_ids.append(self.intern(shape_id))
+        self.shape_labels.append(self.intern(label))
+        self.shape_names.append(self.intern(properties.get('name')))
+        self.shape_types.append(self.intern(properties.get('type')))
+        for name, value in properties.items():
+            self.property_names.append(self.intern(name))
+            self.property_values.append(self.intern(value))
+        self.property_offsets.append(len(self.property_names))
+
+    # Add a connector, given its draw:id and the draw:ids of the shapes at each end (None for an unattached end). The
+    # ends are matched up with the shapes in finish, as a connector can refer to shapes found after it
+    def add_connector(self, connector_id, source_id, destination_id):
+        self.connector_ids.append(self.intern(connector_id))
+        self.connector_source_refs.append(self.intern(source_id))
+        self.connector_destination_refs.append(self.intern(destination_id))
+
+    # Return the index of the shape with the given draw:id, or -1 if there isn't one
+    def shape_index(self, shape_id):
+        if self._shape_index is None:
+            self._shape_index = {self.strings[shape_id]: index for index, shape_id in enumerate(self.shape_ids)}
+        return self._shape_index.get(shape_id, -1)
+
+    # Match the ends of the connectors up with the shapes, then work out the networks and the adjacency arrays. Call
+    # once every shape and connector has been added
+    def finish(self, merge_networks=True):
+        for refs, ends in ((self.connector_source_refs, self.connector_sources),
+                           (self.connector_destination_refs, self.connector_destinations)):
+            del ends[:]
+            ends.extend(self.shape_index(self.string(ref)) if ref >= 0 else -1 for ref in refs)
+
+        self._build_networks(merge_networks)
+        self._build_adjacency()
+
+        # The index of the string table is only needed while strings are being added, and can be rebuilt if more are
+        self._string_index = None
+
+    # Work out the ports of each network in the same way as get_networks, and merge_logical_networks when
+    # merge_networks is set: in the order the networks are first connected to, with their ports in the order they
+    # are connected
+    def _build_networks(self, merge_networks):
+        import powerpoint_to_graphviz as converter
+
+        net = self.intern("net")
+        port = self.intern("port")
+        types = self.shape_types
+
+        ports_of = {}
+        members_of = {}
+        for source, destination in zip(self.connector_sources, self.connector_destinations):
+            if source < 0 or destination < 0:
+                continue
+            if types[source] == port and types[destination] == net:
+                ports_of.setdefault(destination, []).append(source)
+            elif types[source] == net and types[destination] == port:
+                ports_of.setdefault(source, []).append(destination)
+
+        if merge_networks:
+            segments = converter.disjoint_set()
+            first_with_name = {}
+            for network in ports_of:
+                segments.add(network)
+                if self.shape_names[network] >= 0:
+                    segments.union(first_with_name.setdefault(self.shape_names[network], network), network)
+
+            for source, destination in zip(self.connector_sources, self.connector_destinations):
+                if source in segments and destination in segments:
+                    segments.union(source, destination)
+
+            merged = {}
+            for network, ports in ports_of.items():
+                _, merged_ports, members = merged.setdefault(segments.find(network), (network, [], []))
+                merged_ports.extend(ports)
+                members.append(network)
+            ports_of = {network: list(dict.fromkeys(ports)) for network, ports, _ in merged.values()}
+            members_of = {network: members for network, _, members in merged.values()}
+
+        for name in ("network_shapes", "network_port_offsets", "network_ports", "network_member_offsets",
+                     "network_members"):
+            del getattr(self, name)[:]
+        self.network_port_offsets.append(0)
+        self.network_member_offsets.append(0)
+        for network, ports in ports_of.items():
+            self.network_shapes.append(network)
+            self.network_ports.extend(ports)
+            self.network_port_offsets.append(len(self.network_ports))
+            self.network_members.extend(members_of.get(network, [network]))
+            self.network_member_offsets.append(len(self.network_members))
+        self.merged_networks = merge_networks
+
+    # Build the CSR adjacency arrays from the connectors joining two shapes, counting each connector once in each
+    # direction
+    def _build_adjacency(self):
+        shape_count = len(self.shape_ids)
+        degrees = [0] * (shape_count + 1)
+        for source, destination in zip(self.connector_sources, self.connector_destinations):
+            if source >= 0 and destination >= 0:
+                degrees[source + 1] += 1
+                degrees[destination + 1] += 1
+
+        offsets = array(INDEX_TYPE, [0]) * (shape_count + 1)
+        for index in range(shape_count):
+            offsets[index + 1] = offsets[index] + degrees[index + 1]
+
+        targets = array(INDEX_TYPE, [0]) * offsets[shape_count]
+        next_slot = array(INDEX_TYPE, offsets[:shape_count])
+        for source, destination in zip(self.connector_sources, self.connector_destinations):
+            if source >= 0 and destination >= 0:
+                targets[next_slot[source]] = destination
+                next_slot[source] += 1
+                targets[next_slot[destination]] = source
+                next_slot[destination] += 1
+
+        self.adjacency_offsets = offsets
+        self.adjacency_targets = targets
+
+    # Return the adjacency of the shapes in CSR form, as the arrays of offsets and of neighbouring shape indexes
+    def csr_adjacency(self):
+        return self.adjacency_offsets, self.adjacency_targets
+
+    # Return the indexes of the shapes connected to a shape
+    def neighbours(self, index):
+        return self.adjacency_targets[self.adjacency_offsets[index]:self.adjacency_offsets[index + 1]]
+
+    # Return the properties of a shape as a dictionary
+    def shape_properties(self, index):
+        start, end = self.property_offsets[index], self.property_offsets[index + 1]
+        return {self.strings[name]: self.strings[value]
+                for name, value in zip(self.property_names[start:end], self.property_values[start:end])}
+
+    # Return the indexes of the ports of a network
+    def network_port_indexes(self, index):
+        return self.network_ports[self.network_port_offsets[index]:self.network_port_offsets[index + 1]]
+
+    # Return the indexes of the shapes a network was merged from
+    def network_member_indexes(self, index):
+        return self.network_members[self.network_member_offsets[index]:self.network_member_offsets[index + 1]]
+
+    # Return the number of bytes taken up by the arrays and the string table
+    def nbytes(self):
+        return (sum(len(getattr(self, name)) * getattr(self, name).itemsize for name in ARRAY_NAMES)
+                + sum(sys.getsizeof(text) for text in self.strings))
+
+    # Return a network_graph of the same shapes and connectors, for the parts of the converter that work on
+    # dictionaries, such as writing the .dot file. See add_compact_graph in the converter
+    def to_network_graph(self):
+        import powerpoint_to_graphviz as converter
+
+        graph = converter.network_graph()
+        converter.add_compact_graph(self, graph)
+        return graph
+
+    # Build a compact graph from an ODF file (a file name or binary file object), streaming the shapes and
+    # connectors straight into the arrays so that the dictionaries for the whole diagram never exist at once
+    @classmethod
+    def from_odf_file(cls, odf_file, all_pages=False, merge_networks=True):
+        import powerpoint_to_graphviz as converter
+
+        graph = cls()
+        for kind, item in converter.stream_odf_file(odf_file, all_pages):
+            if kind == 'shape':
+                graph.add_shape(item['id'], item['label'])
+            else:
+                graph.add_connector(item['id'], item['source'], item['destination'])
+
+        graph.finish(merge_networks)
+        return graph
+
+    # Build a compact graph from a network_graph that has already been scanned, reusing its parsed properties
+    @classmethod
+    def from_network_graph(cls, network_graph, merge_networks=True):
+        graph = cls()
+        for shape in network_graph.shapes:
+            graph.add_shape(shape['id'], shape['label'], shape['props'])
+        for connector in network_graph.connectors:
+            graph.add_connector(connector['id'], connector['source'], connector['destination'])
+
+        graph.finish(merge_networks)
+        return graph
@@ -0,0 +1,177 @@
+import struct
+import sys
+from array import array
+
+from graph_arrays import compact_graph, ARRAY_NAMES, INDEX_TYPE
+
+
+# Saves a scanned network diagram (its shapes, their parsed label properties, its connectors and the ports of its
+# networks) to a compact binary snapshot, so that later tools (the converter, the diff, the renderer and queries)
+# can start from it in milliseconds instead of unzipping and parsing the presentation again. Anything that accepts
+# an ODF file also accepts a snapshot.
+#
+# A snapshot is a compact_graph (see graph_arrays.py) written out as it is held in memory, little-endian:
+#
+#   - a header: the magic bytes, the format version, flags (bit 0 is set when networks were merged), the number of
+#     arrays, the number of strings and the size of the string data
+#   - the length of each of the arrays, as 64-bit counts
+#   - the byte offsets of the strings in the string data, as 64-bit integers, one more than there are strings
+#   - the string data, UTF-8 encoded
+#   - the arrays of 32-bit indexes, in the order of ARRAY_NAMES
+#
+# Every section starts on an 8-byte boundary, so a snapshot can also be memory-mapped and its arrays used in place.
+# It is loaded with a single read.
+
+
+# The first bytes of a snapshot. The converter tells snapshots apart from ODF files by them (see SNAPSHOT_MAGIC
+# there), without importing this module, so the two must be kept the same
+MAGIC = b"ODFGRAPH"
+
+# The version of the snapshot format. It must change whenever the layout of the file changes
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<8sHHIIQ")
+
+MERGED_NETWORKS_FLAG = 1
+
+
+# Return True if the file (a file name or a binary file object) is a snapshot, judging by its first bytes. A file
+# object is left where it was
+def is_snapshot(snapshot_file):
+    if hasattr(snapshot_file, "read"):
+        position = snapshot_file.tell()
+        magic = snapshot_file.read(len(MAGIC))
+        snapshot_file.seek(position)
+        return magic == MAGIC
+
+    try:
+        with open(snapshot_file, "rb") as opened_file:
+            return opened_file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+# Return the number of padding bytes needed to take a length up to the next 8-byte boundary
+def _padding(length):
+    return -length % 8
+
+
+# Return the bytes of an array of indexes, little-endian
+def _little_endian_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+# Write a compact_graph to a snapshot file (a file name or a binary file object)
+def save_snapshot(graph, snapshot_file):
+    if not hasattr(snapshot_file, "write"):
+        with open(snapshot_file, "wb") as opened_file:
+            return save_snapshot(graph, opened_file)
+
+    encoded = [text.encode("utf-8") for text in graph.strings]
+    string_offsets = array('q', [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+
+    arrays = [getattr(graph, name) for name in ARRAY_NAMES]
+    flags = MERGED_NETWORKS_FLAG if graph.merged_networks else 0
+
+    sections = [HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(arrays), len(encoded), string_offsets[-1]),
+                _little_endian_bytes(array('q', [len(values) for values in arrays])),
+                _little_endian_bytes(string_offsets),
+                b"".join(encoded)]
+    sections.extend(_little_endian_bytes(values) for values in arrays)
+
+    for section in sections:
+        snapshot_file.write(section)
+        snapshot_file.write(bytes(_padding(len(section))))
+
+
+# Read a snapshot file (a file name or a binary file object) in a single read and return the compact_graph in it
+def load_snapshot(snapshot_file):
+    if hasattr(snapshot_file, "read"):
+        data = memoryview(snapshot_file.read())
+    else:
+        with open(snapshot_file, "rb") as opened_file:
+            data = memoryview(opened_file.read())
+
+    if len(data) < HEADER.size or bytes(data[:len(MAGIC)]) != MAGIC:
+        raise Exception("Not a graph snapshot")
+    magic, version, flags, array_count, string_count, string_bytes = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise Exception(f"Graph snapshot format version {version} is not supported (this reads version "
+                        f"{FORMAT_VERSION}); make the snapshot again")
+    if array_count != len(ARRAY_NAMES):
+        raise Exception("Graph snapshot is damaged: it has the wrong number of arrays")
+
+    position = HEADER.size + _padding(HEADER.size)
+
+    def take(typecode, count):
+        nonlocal position
+        values = array(typecode)
+        length = count * values.itemsize
+        if position + length > len(data):
+            raise Exception("Graph snapshot is damaged: it is shorter than it should be")
+        values.frombytes(data[position:position + length])
+        if sys.byteorder == "big":
+            values.byteswap()
+        position += length + _padding(length)
+        return values
+
+    lengths = take('q', array_count)
+    string_offsets = take('q', string_count + 1)
+
+    string_data = bytes(data[position:position + string_bytes])
+    position += string_bytes + _padding(string_bytes)
+
+    graph = compact_graph()
+    graph.strings = [sys.intern(string_data[start:end].decode("utf-8"))
+                     for start, end in zip(string_offsets, string_offsets[1:])]
+    graph._string_index = None
+    graph._shape_index = None
+
+    for name, length in zip(ARRAY_NAMES, lengths):
+        setattr(graph, name, take(INDEX_TYPE, length))
+    graph.merged_networks = bool(flags & MERGED_NETWORKS_FLAG)
+
+    return graph
+
+
+def main(argv=None):
+    import argparse
+    from time import perf_counter
+
+    parser = argparse.ArgumentParser(description="Save the network diagram in an ODF presentation as a graph "
+                                                 "snapshot, or describe a snapshot")
+    parser.add_argument("input", help="the ODF presentation to scan, or with --info the snapshot to describe")
+    parser.add_argument("-o", "--output", default=None,
+                        help="the snapshot file to write (default: the presentation's name with a .odgraph "
+                             "extension)")
+    parser.add_argument("--all-pages", action="store_true",
+                        help="scan the diagrams on every page, instead of only the first")
+    parser.add_argument("--no-merge-networks", dest="merge_networks", action="store_false",
+                        help="keep each drawn network shape as a separate network")
+    parser.add_argument("--info", action="store_true", help="describe a snapshot instead of making one")
+    args = parser.parse_args(argv)
+
+    if args.info:
+        started = perf_counter()
+        graph = load_snapshot(args.input)
+        print(f"loaded in {perf_counter() - started:.4f}s: {len(graph.shape_ids)} shapes, "
+              f"{len(graph.connector_ids)} connectors, {len(graph.network_shapes)} networks "
+              f"({'merged' if graph.merged_networks else 'not merged'}), {len(graph.strings)} strings, "
+              f"{graph.nbytes()} bytes in memory")
+        return 0
+
+    import os
+
+    output = args.output if args.output is not None else os.path.splitext(args.input)[0] + ".odgraph"
+    save_snapshot(compact_graph.from_odf_file(args.input, args.all_pages, args.merge_networks), output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,21 @@
-from zipfile import ZipFile
-import re
-import xml.etree.ElementTree as ET
+import logging
+import sys
+from time import perf_counter
+
+
+# The version of the converter. Cached conversions are keyed on it, so it must change whenever the .dot output
+# generated for a given presentation changes
+__version__ = "0.5.0"
+
+# The first bytes of a graph snapshot, by which snapshots are told apart from ODF files. This is MAGIC in
+# graph_snapshot.py, which is only imported once a file has been found to be a snapshot
+SNAPSHOT_MAGIC = b"ODFGRAPH"
+
+
+# The converter reports its progress through this logger. Nothing is output unless the application using the
+# converter configures logging, or the command line is run with --verbose
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 
 # Encapsulates the list of namespaces use by the XML document being read. Can then be used
@@ -8,32 +23,259 @@ import xml.etree.ElementTree as ET
 # by their fully qualified names.
 class namespace:
 
-    def __init__(self, xml_root_data_as_string):
-        # Read and store the contents of the namespace
-        self._namespace_data = self.read_namespace(xml_root_data_as_string)
-
-    # Read and return the contents if the namespace
-    @staticmethod
-    def read_namespace(xml_root_data_as_string):
-
-        # For each namespace definition in the xml document
-        namespace_temp = {}
-        for match in re.finditer(" xmlns:", xml_root_data_as_string):
-            # Pull off the name=value pair following the 'xmlns:'
-            key_value_tri_str = xml_root_data_as_string[match.end():len(xml_root_data_as_string)].split('"', 2)
-            # Split the name and value and add them into the dictionary
-            namespace_temp[key_value_tri_str[0].split('=', 1)[0]] = key_value_tri_str[1]
-
-        return namespace_temp
+    # The tags and attributes the converter looks for. Their fully qualified names are worked out once, when the
+    # namespace is created, and are then available from the qualified_names table
+    converter_names = (
+        'office:body',
+        'office:presentation',
+        'draw:page',
+        'draw:g',
+        'draw:custom-shape',
+        'draw:connector',
+        'draw:id',
+        'draw:start-shape',
+        'draw:end-shape',
+        'text:p',
+        'text:span'
+    )
+
+    # Create the namespace from a set of prefix to URI declarations. These are read from the start-ns events of
+    # the parser that reads the document, so the document text itself is never searched or copied
+    def __init__(self, declarations):
+        # Store the contents of the namespace
+        self._namespace_data = dict(declarations)
+
+        # Names that have already been expanded, so that each name is only expanded once
+        self._expanded_names = {}
+
+        self.qualified_names = {name: self.expand_namespace(name) for name in self.converter_names}
 
     # Expand the namespace name within a string and return the expanded result. This is useful for
     # searching XML documents for particular values via the etree module
     def expand_namespace(self, string_to_expand):
-        [namespace_name, tag] = string_to_expand.split(':', 1)
-        ns_name = ""
-        if namespace_name in self._namespace_data:
-            ns_name = "{" + self._namespace_data[namespace_name] + "}"
-        return ns_name + tag
+        expanded = self._expanded_names.get(string_to_expand)
+        if expanded is None:
+            [namespace_name, tag] = string_to_expand.split(':', 1)
+            ns_name = ""
+            if namespace_name in self._namespace_data:
+                ns_name = "{" + self._namespace_data[namespace_name] + "}"
+            expanded = ns_name + tag
+            self._expanded_names[string_to_expand] = expanded
+
+        return expanded
+
+
+# An in-memory model of the diagram being converted. Shapes and connectors are added to it once, as they are scanned
+# off the page, and the shapes are indexed by their draw:id and by the name= and type= values held in their labels.
+# This allows the later stages to look up the ends of a connector, or all the shapes of a type, with a single hash
+# lookup instead of walking the full list of shapes for every connector.
+#
+# A tolerant graph accepts whatever is scanned, so that a document can be validated in full: instead of raising an
+# exception at the first label that can't be parsed, shape ID that is used twice or connector that isn't attached at
+# both ends, it notes each of them in problems (as validation diagnostics) and carries on.
+class network_graph:
+
+    def __init__(self, tolerant=False):
+        self.tolerant = tolerant
+        self.problems = []
+        self.shapes = []
+        self.connectors = []
+        self._shapes_by_id = {}
+        self._shapes_by_name = {}
+        self._shapes_by_type = {}
+
+        # The number of shape labels parsed into properties during this run. Each label should be parsed exactly once
+        self.label_parses = 0
+
+        # The number of shape lookups made against the indexes during this run
+        self.lookups = 0
+
+        # Networks that have already been worked out for the graph, such as those loaded from a snapshot, keyed on
+        # whether networks with the same name were merged
+        self.compiled_networks = {}
+
+    # Add a scanned shape to the graph and index it. The label is parsed here, once, and the resulting properties are
+    # kept on the shape as 'props', along with its 'type' and 'name' (None where the label doesn't define them), so
+    # that the rest of the conversion never has to parse it again. Properties that have already been parsed from the
+    # label can be passed in instead
+    def add_shape(self, shape, properties=None):
+        # Shapes that nothing is connected to are often saved without a draw:id. A tolerant graph makes one up, in
+        # the same way as for connectors, so that the shape can still be checked
+        if shape['id'] is None:
+            if not self.tolerant:
+                raise Exception(f"Shape labelled {tidy_text(shape['label'])!r} has no draw:id")
+            shape_number = len(self.shapes) + 1
+            while f"shape_id{shape_number}" in self._shapes_by_id:
+                shape_number += 1
+            shape['id'] = f"shape_id{shape_number}"
+            self.problems.append(diagnostic("error", "missing_id", shape['id'],
+                                            f"shape labelled {tidy_text(shape['label'])!r} has no draw:id"))
+
+        if shape['id'] in self._shapes_by_id:
+            if not self.tolerant:
+                raise Exception(f"can't have more than one shape with the id {shape['id']}")
+            self.problems.append(diagnostic("error", "duplicate_id", shape['id'],
+                                            "more than one shape has this id; only the first is used"))
+            return
+
+        if properties is None:
+            try:
+                properties = get_object_properties_from_label(shape['label'])
+            except Exception:
+                if not self.tolerant:
+                    raise
+                self.problems.append(diagnostic("error", "bad_label", shape['id'],
+                                                f"label {tidy_text(shape['label'])!r} is not a comma separated list "
+                                                f"of name=value pairs"))
+                properties = {}
+            self.label_parses += 1
+        set_object_properties(shape, properties)
+
+        self.shapes.append(shape)
+        self._shapes_by_id[shape['id']] = shape
+
+        # Index by name and type where the label defines them
+        if shape['name'] is not None:
+            self._shapes_by_name.setdefault(shape['name'], []).append(shape)
+
+        if shape['type'] is not None:
+            self._shapes_by_type.setdefault(shape['type'], []).append(shape)
+
+    # Add a scanned connector to the graph. Both of its ends must be attached to something
+    def add_connector(self, connector):
+        if connector['source'] is None or connector['destination'] is None:
+            if not self.tolerant:
+                raise Exception(f"Connector {connector['id']} is not attached to a shape at both ends")
+            self.problems.append(diagnostic("error", "unattached_connector", connector['id'],
+                                            "connector is not attached to a shape at both ends"))
+        self.connectors.append(connector)
+
+    # Return the shape with the given draw:id, or None if there isn't one
+    def get_shape_by_id(self, shape_id):
+        self.lookups += 1
+        return self._shapes_by_id.get(shape_id)
+
+    # Return the shape labelled with the given name=, or None if there isn't one. Where names are repeated the last
+    # shape scanned wins, as it did when the list was searched from start to end
+    def get_shape_by_name(self, shape_name):
+        shapes = self.get_shapes_by_name(shape_name)
+        return shapes[-1] if shapes else None
+
+    # Return a list of all the shapes labelled with the given name=, in the order they were scanned
+    def get_shapes_by_name(self, shape_name):
+        self.lookups += 1
+        return self._shapes_by_name.get(shape_name, [])
+
+    # Return a list of all the shapes labelled with the given type=, in the order they were scanned
+    def get_shapes_by_type(self, shape_type):
+        self.lookups += 1
+        return self._shapes_by_type.get(shape_type, [])
+
+
+# Records how long each step of a conversion takes and, optionally, the peak memory allocated during it, along
+# with counts of the objects handled. Used to work out where the time goes in a conversion, and to compare runs.
+# Memory is measured with tracemalloc, which slows the conversion down and covers the whole process, so it is only
+# switched on when asked for and the figures are only meaningful when one conversion is running at a time.
+class conversion_stats:
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.counters = {}
+        self._started_tracing = False
+
+    # Time a step of the conversion. Use as 'with stats.stage("name"):' around the step
+    def stage(self, name):
+        return _stage_timer(self, name)
+
+    # Record a step whose time was measured some other way, such as by a read_timer
+    def add_stage(self, name, seconds, peak_bytes=None):
+        self.stages.append({'stage': name, 'seconds': seconds, 'peak_bytes': peak_bytes})
+
+    # Set a counter to a value
+    def count(self, name, value):
+        self.counters[name] = value
+
+    # Stop tracing memory if we started it
+    def close(self):
+        if self._started_tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    # Return the recorded figures as a dictionary, ready to be written out as JSON
+    def as_dict(self):
+        return {
+            'stages': self.stages,
+            'total_seconds': sum(stage['seconds'] for stage in self.stages),
+            'counters': self.counters
+        }
+
+    # Return the recorded figures as a human-readable table
+    def format_table(self):
+        lines = [f"{'stage':<24}{'seconds':>12}{'peak memory':>16}"]
+        for stage in self.stages:
+            peak = "" if stage['peak_bytes'] is None else f"{stage['peak_bytes'] / 1048576:.2f} MiB"
+            lines.append(f"{stage['stage']:<24}{stage['seconds']:>12.4f}{peak:>16}")
+        lines.append(f"{'total':<24}{self.as_dict()['total_seconds']:>12.4f}")
+        lines.append("")
+        for name, value in self.counters.items():
+            lines.append(f"{name:<24}{value:>12}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Context manager used by conversion_stats.stage to time a single step
+class _stage_timer:
+
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+        self._excluded = 0.0
+
+    # Leave time spent on something recorded as a separate step, such as reading the input, out of this step
+    def exclude(self, seconds):
+        self._excluded += seconds
+
+    def __enter__(self):
+        if self._stats.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._stats._started_tracing = True
+            tracemalloc.reset_peak()
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = perf_counter() - self._start - self._excluded
+        peak_bytes = None
+        if self._stats.trace_memory:
+            import tracemalloc
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        self._stats.add_stage(self._name, seconds, peak_bytes)
+        return False
+
+
+# Adds up the time spent reading from a binary stream. Wrapped around the content.xml member of the zip as it is
+# streamed, it measures the time spent reading and decompressing the member, apart from the time spent parsing it
+class read_timer:
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._stream = None
+
+    # Time the reads from the stream, which are made through this object from now on
+    def wrap(self, stream):
+        self._stream = stream
+        return self
+
+    def read(self, size=-1):
+        started = perf_counter()
+        try:
+            return self._stream.read(size)
+        finally:
+            self.seconds += perf_counter() - started
 
 
 # Open the xml file that contains the main contents of the PowerPoint.
@@ -49,6 +291,8 @@ def read_the_extracted_xml_file(file_name):
 # Open the ODF file, decompress it and pull out the content of the relevant XML file which
 # describes the content of the file.
 def read_odf_file(file_name):
+    from zipfile import ZipFile
+
     with ZipFile(file_name, 'r') as zip:
         odf_data = zip.read("content.xml")
 
@@ -56,137 +300,323 @@ def read_odf_file(file_name):
     return odf_data.decode("utf-8")
 
 
-# Parse from the root of the XML down to location where the network diagram is contained
-def get_page_from_powerpoint_data(root):
+# Return True if the open binary file is a graph snapshot rather than an ODF file, judging by its first bytes. The
+# file is left where it was
+def is_graph_snapshot(binary_file):
+    position = binary_file.tell()
+    magic = binary_file.read(len(SNAPSHOT_MAGIC))
+    binary_file.seek(position)
+    return magic == SNAPSHOT_MAGIC
+
+
+# Parse the XML document into a tree, collecting its namespace declarations from the parser as it goes. Returns
+# the root of the tree along with the namespace
+def parse_xml_data(xml_data):
+    from io import BytesIO
+    import xml.etree.ElementTree as ET
+
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode("utf-8")
+
+    declarations = {}
+    root = None
+    for event, item in ET.iterparse(BytesIO(xml_data), events=('start-ns', 'start')):
+        if event == 'start-ns':
+            prefix, uri = item
+            declarations[prefix] = uri
+        elif root is None:
+            root = item
+
+    return root, namespace(declarations)
+
+
+# Parse from the root of the XML down to location where the network diagram is contained, and return the pages of
+# the presentation: just the first page, or every page when all_pages is set so that their contents can be
+# aggregated into a single network diagram
+def get_pages_from_powerpoint_data(root, ns, all_pages=False):
 
     # Note: This function is customised for open document format (ODF) files saved from PowerPoint.
     # These files can also be generated in OpenOffice. To parse other ODF formats generated, by, for
     # example, Visio or OpenOffice Draw, minor changes to this function are required to navigate the
-    # very slightly different XML tree structure in those formats. Note, it would also be easily possible
-    # to scan a a list of all the pages allowing aggregation their contents as a single network diagram
-    # if we amend this function to return a list of all pages instead of the first one found.
+    # very slightly different XML tree structure in those formats.
 
     # Extract the body from the document
-    body = root.find(ns.expand_namespace('office:body'))
+    body = root.find(ns.qualified_names['office:body'])
 
     # Extract the drawing (called drawing for open ofic draw, or presentation for powerpoints)
-    drawing = body.find(ns.expand_namespace('office:presentation'))  # For powerpoints
+    drawing = body.find(ns.qualified_names['office:presentation'])  # For powerpoints
+
+    # Read all the pages of the document
+    if all_pages:
+        return drawing.findall(ns.qualified_names['draw:page'])
+
+    # Or just the first page
+    page = drawing.find(ns.qualified_names['draw:page'])
+    return [page] if page is not None else []
 
-    # Read the first page of the document
-    page = drawing.find(ns.expand_namespace('draw:page'))
 
-    return page
+# Parse from the root of the XML down to location where the network diagram is contained, and return the first page
+def get_page_from_powerpoint_data(root, ns):
+    pages = get_pages_from_powerpoint_data(root, ns)
+    return pages[0] if pages else None
 
 
 # Parses through the XML paragraphs that make up the contents of the text box within a shape, and sticthes them
-# together
-def get_shape_label(shape):
-    label = ""
+# together. All of the text in each paragraph is read in a single walk, whether it sits directly in the paragraph or
+# in spans (however deeply nested), and the lines are normalised as they are read (see normalise_label_lines), so the
+# label comes out with one clean line per paragraph. Everything else that needs the label, from the property parser
+# to the .dot writers, works from this
+def get_shape_label(shape, ns):
 
     # Read each line of the text comments from within the shape's text box
-    paragraphs = shape.findall(ns.expand_namespace('text:p'))
+    paragraphs = shape.findall(ns.qualified_names['text:p'])
+    label = "\n".join(normalise_label_lines("".join(paragraph.itertext()) for paragraph in paragraphs))
 
-    # For each paragraph
-    for paragraph in paragraphs:
+    logger.debug('label: %s', label)
+    return label
 
-        # Get all of the snippets of text that exist within the paragraph
-        snippets = paragraph.findall(ns.expand_namespace('text:span'))
 
-        # Stitch all the snippets together into a single line
-        for snippet in snippets:
-            if snippet.text is not None:
-                label += snippet.text
+# Read the relevant node data from a single custom shape element. Its ID is None if it doesn't have a draw:id
+def scan_custom_shape(shape, ns):
+    return {
+        'id': shape.attrib.get(ns.qualified_names['draw:id']),
+        'shape': 'egg',
+        # Read the label by assembling together all the text contents of the box
+        'label': get_shape_label(shape, ns)
+    }
 
-        # Add a newline at the end of each paragraph
-        label += "\n"
 
-    print(f'label: {label}')
-    return label
+# Read the relevant edge data from a single connector element. The edge count is used to generate a unique ID
+# for the connector if it doesn't have one of its own
+def scan_connector(edge, ns, edge_count):
 
+    # Check if the unique ID is available
+    try:
+        connector_id = edge.attrib[ns.qualified_names['draw:id']]
+
+    # If it isn't, generate one ourselves
+    except Exception:
+        connector_id = f"con_id{edge_count}"
+
+    # An end that isn't attached to a shape is left as None, and reported when the connector is added to the graph
+    return {
+        'id': connector_id,
+        'source': edge.attrib.get(ns.qualified_names['draw:start-shape']),
+        'destination': edge.attrib.get(ns.qualified_names['draw:end-shape']),
+        'label': ""
+    }
+
+
+# Walk through the given pages in a single pass, generating a ('shape', element) or ('connector', element) pair for
+# every custom shape and connector in document order. The contents of groups are included, however deeply they are
+# nested; anything else on the page (frames, notes and so on) is passed over.
+def walk_page_elements(pages, ns):
+    shape_tag = ns.qualified_names['draw:custom-shape']
+    connector_tag = ns.qualified_names['draw:connector']
+    group_tag = ns.qualified_names['draw:g']
+
+    for page in pages:
+
+        # The children still to be visited at each level of grouping, from the page down
+        levels = [iter(page)]
+        while levels:
+            for element in levels[-1]:
+                if element.tag == shape_tag:
+                    yield 'shape', element
+                elif element.tag == connector_tag:
+                    yield 'connector', element
+                elif element.tag == group_tag:
+                    # Visit the group's children before carrying on with the rest of this level
+                    levels.append(iter(element))
+                    break
+            else:
+                levels.pop()
 
-# Get a list of all the shapes in the immediate level of the first page. Note we don't pull out the contents of groups,
-# so shapes inside any groups will be ignored. Groups break the source-destination linkages of connectors so should be
-# avoided when defining networks.
-def get_shapes(page):
 
-    # Read all the shapes (vms and ports and networks) off the page
-    shapes = page.findall(ns.expand_namespace('draw:custom-shape'))
+# Read all the shapes and connectors off the given pages in a single pass, adding them to the graph. Returns the
+# lists of scanned shapes and scanned connectors
+def scan_pages(pages, graph, ns):
 
-    # Read the relevant node data from each of the shapes
-    scanned_shapes = []
-    for shape in shapes:
-        # Read the label by assembling together all the text contents of the box
+    # Can be used to add a unique ID to the edge if it is missing
+    edge_count = 0
+
+    for kind, element in walk_page_elements(pages, ns):
+        if kind == 'shape':
+            graph.add_shape(scan_custom_shape(element, ns))
+        else:
+            # Update the generator we use for our unique ID if one is not found in the connector
+            edge_count += 1
+            graph.add_connector(scan_connector(element, ns, edge_count))
 
-        scanned_shapes.append({
-            'id': shape.attrib[ns.expand_namespace('draw:id')],
-            'shape': 'egg',
-            'label': get_shape_label(shape)
-        })
+    return graph.shapes, graph.connectors
 
-    return scanned_shapes
+
+# Get a list of all the shapes on a page, including those inside groups.
+def get_shapes(page, graph, ns):
+
+    # Read the relevant node data from each of the shapes (vms and ports and networks) and add it to the graph
+    for kind, shape in walk_page_elements([page], ns):
+        if kind == 'shape':
+            graph.add_shape(scan_custom_shape(shape, ns))
+
+    return graph.shapes
 
 
 # Read all the connectors that join one shape to another. Connectors in PowerPoint have a source and destination
 # object. We are concerned with connectors, not lines (lines have no source and destination)
-def get_connectors(page):
+def get_connectors(page, graph, ns):
 
     # Can be used to add a unique ID to the edge if it is missing
     edge_count = 0
 
-    # Read all the unlabelled connectors off the page (joining vms to ports or networks to ports)
-    edges = page.findall(ns.expand_namespace('draw:connector'))
+    # Read the relevant node data from each of the connectors (joining vms to ports or networks to ports) and add it
+    # to the graph
+    for kind, edge in walk_page_elements([page], ns):
+        if kind == 'connector':
 
-    # Read the relevant node data from each of the shapes
-    scanned_connectors = []
-    for edge in edges:
+            # Update the generator we use for our unique ID if one is not found in the connector
+            edge_count += 1
+            graph.add_connector(scan_connector(edge, ns, edge_count))
 
-        # Update the generator we use for our unique ID if one is not found in the connector
-        edge_count += 1
+    return graph.connectors
 
-        # Check if the unique ID is available
-        try:
-            connector_id = edge.attrib[ns.expand_namespace('draw:id')]
 
-        # If it isn't, generate one ourselves
-        except Exception:
-            connector_id = f"con_id{edge_count}"
+# Stream the content of the ODF file straight out of its zip member, rather than reading it all into memory first,
+# and generate a ('shape', shape) or ('connector', connector) pair for each shape and connector on the first page (or
+# on every page, when all_pages is set) as soon as its element has been parsed. As with walk_page_elements, the
+# contents of groups are included. Elements are discarded once they have been dealt with, so the memory used
+# stays flat however large the presentation is. The shapes and connectors are the same as those read by scan_pages.
+# The reads from the zip member are timed by content_timer, if a read_timer is given.
+def stream_odf_file(file_name, all_pages=False, content_timer=None):
+    from zipfile import ZipFile
+    import xml.etree.ElementTree as ET
 
-        # Read the label by assembling together all the text contents of the box
-        try:
-            scanned_connectors.append({
-                'id': connector_id,
-                'source': edge.attrib[ns.expand_namespace('draw:start-shape')],
-                'destination': edge.attrib[ns.expand_namespace('draw:end-shape')],
-                'label': ""
-            })
+    with ZipFile(file_name, 'r') as zip:
+        with zip.open("content.xml") as content:
+            if content_timer is not None:
+                content = content_timer.wrap(content)
+
+            # Namespaces are declared before the elements that use them, so they are read from the parser as it goes
+            declarations = {}
+            ns = None
+
+            # The elements that are currently open, from the root down, and whether each of them is a page (or a
+            # group within a page) whose shapes and connectors we are reading
+            open_elements = []
+            containers = []
+
+            # How many pages have been seen, and how many shapes and connectors we are currently inside of (their
+            # children have to be kept until the shape or connector itself is complete)
+            pages_seen = 0
+            inside_item = 0
+            edge_count = 0
+
+            for event, element in ET.iterparse(content, events=('start-ns', 'start', 'end')):
+
+                if event == 'start-ns':
+                    prefix, uri = element
+                    declarations[prefix] = uri
+                    ns = None
+                    continue
+
+                if ns is None:
+                    ns = namespace(declarations)
+                    page_tag = ns.qualified_names['draw:page']
+                    group_tag = ns.qualified_names['draw:g']
+                    shape_tag = ns.qualified_names['draw:custom-shape']
+                    connector_tag = ns.qualified_names['draw:connector']
+
+                if event == 'start':
+                    if element.tag == page_tag:
+                        containers.append(all_pages or pages_seen == 0)
+                        pages_seen += 1
+                    elif element.tag == group_tag:
+                        containers.append(bool(containers) and containers[-1])
+                    else:
+                        containers.append(False)
+                        if element.tag == shape_tag or element.tag == connector_tag:
+                            inside_item += 1
+                    open_elements.append(element)
+                    continue
+
+                open_elements.pop()
+                containers.pop()
+                parent = open_elements[-1] if open_elements else None
+
+                if element.tag == shape_tag or element.tag == connector_tag:
+                    inside_item -= 1
+
+                    # Only take the shapes and connectors on the pages we are reading, and in their groups
+                    if containers and containers[-1]:
+                        if element.tag == shape_tag:
+                            yield 'shape', scan_custom_shape(element, ns)
+                        else:
+                            edge_count += 1
+                            yield 'connector', scan_connector(element, ns, edge_count)
+
+                # When only reading the first page, there's nothing more to do once it is complete
+                if element.tag == page_tag and not all_pages:
+                    return
+
+                # Throw away everything that has been dealt with, unless it is part of a shape or connector
+                # that is still being read
+                if inside_item == 0 and parent is not None:
+                    element.clear()
+                    parent.remove(element)
+
+
+# Read the shapes and connectors from the ODF file using the streaming reader, adding them to the graph. Returns the
+# same lists of scanned shapes and scanned connectors as scan_pages. See stream_odf_file for content_timer
+def scan_odf_file(file_name, graph, all_pages=False, content_timer=None):
+
+    for kind, item in stream_odf_file(file_name, all_pages, content_timer):
+        if kind == 'shape':
+            graph.add_shape(item)
+        else:
+            graph.add_connector(item)
 
-        except Exception as e:
-            raise Exception(f"Edge was: {edge}, Exception was {e}")
+    return graph.shapes, graph.connectors
 
-    return scanned_connectors
 
+# Add the shapes and connectors of a compact_graph (see graph_arrays.py), such as one loaded from a snapshot, to the
+# graph. The labels are not parsed again, and the networks are added to its compiled_networks, so they aren't worked
+# out again either
+def add_compact_graph(compact, graph):
+    strings = compact.strings
 
-# Look up the source and destination of the connector and return it in the same object
-def get_source_and_dest(connector, scanned_shapes):
+    for index in range(len(compact.shape_ids)):
+        graph.add_shape({'id': strings[compact.shape_ids[index]], 'shape': 'egg',
+                         'label': strings[compact.shape_labels[index]]}, compact.shape_properties(index))
 
-    source = None
-    dest = None
-    source_id = connector['source']
-    dest_id = connector['destination']
-    for shape in scanned_shapes:
+    for index in range(len(compact.connector_ids)):
+        graph.add_connector({'id': strings[compact.connector_ids[index]],
+                             'source': compact.string(compact.connector_source_refs[index]),
+                             'destination': compact.string(compact.connector_destination_refs[index]),
+                             'label': ""})
 
-        # If the connector ID matches the source
-        if shape['id'] == source_id:
-            if source is not None:
-                raise Exception("can't have more than one source for a connector")
-            else:
-                source = shape
+    networks = []
+    for index, shape_index in enumerate(compact.network_shapes):
+        shape = graph.get_shape_by_id(strings[compact.shape_ids[shape_index]])
+        network = include_in_network_list({}, shape)[shape['id']]
+        network['ports'] = [strings[compact.shape_ids[port]] for port in compact.network_port_indexes(index)]
+        if compact.merged_networks:
+            network['merged_ids'] = [strings[compact.shape_ids[member]]
+                                     for member in compact.network_member_indexes(index)]
+        networks.append(network)
+    graph.compiled_networks[compact.merged_networks] = networks
 
-        if shape['id'] == dest_id:
-            if dest is not None:
-                raise Exception("can't have more than one dest for a connector")
-            else:
-                dest = shape
+
+# Look up the source and destination of the connector and return it in the same object. Shape IDs are unique within
+# the graph, so each end of the connector is a single indexed lookup. An end attached to a shape that isn't in the
+# diagram is an error, unless allow_missing is set, in which case it is returned as None
+def get_source_and_dest(connector, graph, allow_missing=False):
+
+    source = graph.get_shape_by_id(connector['source'])
+    dest = graph.get_shape_by_id(connector['destination'])
+
+    if not allow_missing and (source is None or dest is None):
+        missing = connector['source'] if source is None else connector['destination']
+        raise Exception(f"Connector {connector['id']} is attached to {missing}, which is not in the diagram")
 
     return source, dest
 
@@ -198,12 +628,15 @@ def get_object_label(shape):
     return shape['label']
 
 
-# Read a string defining a current object. Read each name=value pair into the label into a dictionary entry
+# Read a string defining a current object. Read each name=value pair into the label into a dictionary entry. The
+# names and values are interned, as the same ones (type=port and so on) are repeated across the whole diagram
 def get_object_properties_from_label(label_string):
     label_string = label_string.replace('\\n', '')
     label_string = label_string.strip('"')
+    intern = sys.intern
     try:
-        props = dict((x.strip(), y.strip()) for x, y in (element.split('=') for element in label_string.split(',')))
+        props = {intern(x.strip()): intern(y.strip())
+                 for x, y in (element.split('=') for element in label_string.split(','))}
     except Exception as e:
         raise Exception(f"\nLabel was in the wrong format. Require comma separated list of valid name-value pairs:\n"
                         f"Exact issue was {e}")
@@ -211,9 +644,21 @@ def get_object_properties_from_label(label_string):
     return props
 
 
+# Store the properties parsed from an object's label on the object itself, along with the two properties that
+# are looked up most often
+def set_object_properties(shape, properties):
+    shape['props'] = properties
+    shape['type'] = properties.get('type')
+    shape['name'] = properties.get('name')
+
+
 # Read the value of a specific parameter from the an object label
 def get_object_parameter(shape, param_name):
 
+    # Use the properties parsed when the shape was scanned if we have them
+    if 'props' in shape:
+        return shape['props'].get(param_name)
+
     # Default is to return None if the param doesn't exist
     param_value = None
 
@@ -244,29 +689,29 @@ def matches_parameter_value_pair(item, param, value):
 
 # Look at the type of a shape and determine whether it is a port
 def is_a_port(shape):
-    return matches_parameter_value_pair(shape, "type", "port")
+    return get_object_parameter(shape, "type") == "port"
 
 
 # Look at the type of a shape and determines whether it is a vm
 def is_a_vm(shape):
-    return matches_parameter_value_pair(shape, "type", "vm")
+    return get_object_parameter(shape, "type") == "vm"
 
 
 # Looks at the type of a shape and determines whether it is a network
 def is_a_network(shape):
-    return matches_parameter_value_pair(shape, "type", "net")
+    return get_object_parameter(shape, "type") == "net"
 
 
 # Look at a list of network items, searching for one that has the described name-value pair.
 # Returns its list index if found, otherwise returns None
 def find_on_list(list_of_shapes, param_name, param_value):
 
-    print(f"finding {param_name}={param_value} in {list_of_shapes}")
+    logger.debug("finding %s=%s in %s", param_name, param_value, list_of_shapes)
     index_of_found_item = None
     # Look through the list for a match, and if found get its index in the list
-    for shape in list_of_shapes:
+    for index, shape in enumerate(list_of_shapes):
         if matches_parameter_value_pair(shape, param_name, param_value):
-            index_of_found_item = list_of_shapes.index(shape)
+            index_of_found_item = index
 
     return index_of_found_item
 
@@ -277,75 +722,335 @@ def find_on_list_by_id(list_of_shapes, param_value):
 
     index_of_found_item = None
     # Look through the list for a match, and if found get its index in the list
-    for shape in list_of_shapes:
+    for index, shape in enumerate(list_of_shapes):
         if shape['id'] == param_value:
-            index_of_found_item = list_of_shapes.index(shape)
+            index_of_found_item = index
 
     return index_of_found_item
 
 
-# Checks whether a network is currently on a list of networks. If it is, does nothing,
+# Checks whether a network is currently in a dictionary of networks keyed by ID. If it is, does nothing,
 # but if it isn't, adds it in
-def include_in_network_list(list, network):
+def include_in_network_list(networks, network):
 
-    print(f"adding network: {network}")
+    logger.debug("adding network: %s", network)
     # If it isn't on the list, add it.
-    if find_on_list_by_id(list_of_shapes=list, param_value=network['id']) is None:
-        print(f"adding shape {network['id']} to {list}")
-        list.append({
+    if network['id'] not in networks:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("adding shape %s to %s", network['id'], list(networks))
+        networks[network['id']] = {
             'id': network['id'],
             'shape': network['shape'],
             'label': network['label'],
+            'props': network['props'],
+            'type': network['type'],
+            'name': network['name'],
             'ports': []
-        })
-
-    return list
+        }
 
+    return networks
 
-# Assuming a specified network is already on the list, add a port to it.
-def add_port_to_network_node(list, network, port):
 
-    item_index = find_on_list_by_id(list_of_shapes=list, param_value=network['id'])
+# Assuming a specified network is already in the dictionary of networks, add a port to it.
+def add_port_to_network_node(networks, network, port):
 
     # Check the thing we're adding to is in the list
-    if item_index is None:
+    if network['id'] not in networks:
         raise Exception("Can't add port to a network that isn't on the list")
 
     # If it is then add it and return the updated list
-    list[item_index]['ports'].append(port['id'])
-    return list
+    networks[network['id']]['ports'].append(port['id'])
+    return networks
 
 
 # Get a list of network nodes, each node containing a list of ports connected to it. We will
 # later (in another function) transform each of these into a separate graphviz edge. Typically we would
 # have two ports connected to each network node, but the connection of more than two ports to a single
 # network node is supported and will result in an A -- B -- C -- etc. line in the generated graphviz.
-def get_networks(scanned_connectors, scanned_shapes):
-    
-    # Read through all the connectors bulding up a list of networks nodes and ports they connect to
-    network_list = []
+def get_networks(scanned_connectors, graph):
+
+    # Read through all the connectors bulding up the networks nodes and ports they connect to. The networks are
+    # keyed by ID so that each connector can find its network directly; dictionaries keep their insertion order
+    # so the networks come out in the order they were first seen
+    networks = {}
     for connector in scanned_connectors:
-        print(f"considering connector {connector}")
+        logger.debug("considering connector %s", connector)
         # If a connector joins a port to a network
-        source, dest = get_source_and_dest(connector, scanned_shapes)
-        print(f"source={source['id']}  destination={dest['id']}")
+        source, dest = get_source_and_dest(connector, graph)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("source=%s  destination=%s", source['id'], dest['id'])
         if is_a_port(source) and is_a_network(dest):
 
             # Make a note of this network node if we haven't already
-            network_list = include_in_network_list(list=network_list, network=dest)
+            networks = include_in_network_list(networks=networks, network=dest)
 
             # Add the source to this network node's connectivity list
-            network_list = add_port_to_network_node(list=network_list, network=dest, port=source)
+            networks = add_port_to_network_node(networks=networks, network=dest, port=source)
 
         elif is_a_port(dest) and is_a_network(source):
 
             # Make a note of this network node if we haven't already
-            network_list = include_in_network_list(list=network_list, network=source)
+            networks = include_in_network_list(networks=networks, network=source)
 
             # Add the source to this network node's connectivity list
-            network_list = add_port_to_network_node(list=network_list, network=source, port=dest)
+            networks = add_port_to_network_node(networks=networks, network=source, port=dest)
+
+    return list(networks.values())
+
+
+# A disjoint-set (union-find) structure over hashable items. Items are added as they are first mentioned, and
+# union joins the sets of two items. Path halving and union by size keep each operation close to constant time,
+# so grouping n items takes near-linear time overall.
+class disjoint_set:
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def __contains__(self, item):
+        return item in self._parent
+
+    # Add an item in a set of its own, if it isn't already known
+    def add(self, item):
+        if item not in self._parent:
+            self._parent[item] = item
+            self._size[item] = 1
+
+    # Return the representative item of the set containing the item
+    def find(self, item):
+        self.add(item)
+        parent = self._parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+
+        return item
+
+    # Join the sets containing the two items
+    def union(self, first, second):
+        first = self.find(first)
+        second = self.find(second)
+        if first == second:
+            return
+
+        if self._size[first] < self._size[second]:
+            first, second = second, first
+        self._parent[second] = first
+        self._size[first] += self._size[second]
 
-    return network_list
+
+# Merge the network nodes produced by get_networks into logical networks. A network that is drawn more than once, as
+# several shapes with the same name=, is a single logical network, as are network shapes joined directly to each
+# other by a connector. Each logical network keeps the ID, label and properties of the first of its shapes to be
+# found, and the ports of all of them, each port appearing once. This means a network drawn across several places
+# or pages comes out as a single edge chain in the .dot file
+def merge_logical_networks(network_list, scanned_connectors, graph):
+
+    segments = disjoint_set()
+
+    # Networks with the same name are the same network
+    first_with_name = {}
+    for network in network_list:
+        segments.add(network['id'])
+        if network['name'] is not None:
+            segments.union(first_with_name.setdefault(network['name'], network['id']), network['id'])
+
+    # As are networks that are connected directly to each other
+    for connector in scanned_connectors:
+        source, dest = get_source_and_dest(connector, graph)
+        if source is not None and dest is not None and is_a_network(source) and is_a_network(dest):
+            if source['id'] in segments and dest['id'] in segments:
+                segments.union(source['id'], dest['id'])
+
+    # Collect the ports of each logical network, in the order the networks were found
+    merged = {}
+    for network in network_list:
+        root = segments.find(network['id'])
+        if root not in merged:
+            merged[root] = dict(network, ports=[])
+            merged[root]['merged_ids'] = []
+        merged[root]['merged_ids'].append(network['id'])
+        merged[root]['ports'].extend(network['ports'])
+
+    for network in merged.values():
+        network['ports'] = list(dict.fromkeys(network['ports']))
+
+    return list(merged.values())
+
+
+# Split the compiled nodes, edges and networks of a diagram into its connected components: the groups of VMs and
+# ports joined to each other, directly or through networks. Returns a list of the (nodes, edges, networks) of each
+# component, in the order their first nodes were found, each list keeping the order of the whole diagram
+def connected_components(non_network_nodes, non_network_edges, network_connectors):
+
+    components = disjoint_set()
+    for node in non_network_nodes:
+        components.add(node['id'])
+    for edge in non_network_edges:
+        components.union(edge['source'], edge['destination'])
+    for network in network_connectors:
+        for port_id in network['ports'][1:]:
+            components.union(network['ports'][0], port_id)
+
+    by_root = {}
+    for node in non_network_nodes:
+        by_root.setdefault(components.find(node['id']), ([], [], []))[0].append(node)
+    for edge in non_network_edges:
+        by_root.setdefault(components.find(edge['source']), ([], [], []))[1].append(edge)
+    for network in network_connectors:
+        if network['ports']:
+            by_root.setdefault(components.find(network['ports'][0]), ([], [], []))[2].append(network)
+
+    return list(by_root.values())
+
+
+# Group the VM and port nodes into clusters centred on each VM. Returns a list of (vm, ports) pairs, one per VM in
+# the order they were found, and a list of the nodes that don't belong to any VM. A port joined to more than one VM
+# belongs to the first of them
+def vm_clusters(non_network_nodes, non_network_edges):
+
+    vm_ids = {node['id'] for node in non_network_nodes if is_a_vm(node)}
+    owner_of = {}
+    for edge in non_network_edges:
+        if edge['source'] in vm_ids and edge['destination'] not in vm_ids:
+            owner_of.setdefault(edge['destination'], edge['source'])
+        elif edge['destination'] in vm_ids and edge['source'] not in vm_ids:
+            owner_of.setdefault(edge['source'], edge['destination'])
+
+    clusters = {node['id']: (node, []) for node in non_network_nodes if node['id'] in vm_ids}
+    loose_nodes = []
+    for node in non_network_nodes:
+        if node['id'] in vm_ids:
+            continue
+        owner = owner_of.get(node['id'])
+        if owner is not None:
+            clusters[owner][1].append(node)
+        else:
+            loose_nodes.append(node)
+
+    return list(clusters.values()), loose_nodes
+
+
+# An index of what each VM and port in a compiled diagram is joined to: the edges to the VMs and ports it is connected
+# to directly, and the networks it is attached to. It is built once, in a single pass over the edges and networks,
+# after which the neighbourhood of any object can be found in time proportional to the size of the neighbourhood
+class adjacency_index:
+
+    def __init__(self, non_network_edges, network_connectors):
+        self.edges_of = {}
+        self.networks_of = {}
+
+        # Network shapes are indexed by the ID of every shape they were merged from
+        self.network_by_shape_id = {}
+
+        for edge in non_network_edges:
+            self.edges_of.setdefault(edge['source'], []).append(edge)
+            self.edges_of.setdefault(edge['destination'], []).append(edge)
+
+        for network in network_connectors:
+            for shape_id in network.get('merged_ids', [network['id']]):
+                self.network_by_shape_id[shape_id] = network
+            for port_id in network['ports']:
+                self.networks_of.setdefault(port_id, []).append(network)
+
+    # Return the IDs of the objects within the given number of hops of the starting objects, each mapped to its
+    # distance from the nearest of them, in the order they were reached. Ports on the same network are one hop
+    # apart, as they are joined by a single edge in the .dot file. Also returns the networks that were crossed, which
+    # start with start_networks, the networks the starting objects are the ports of
+    def neighbourhood(self, start_ids, hops, start_networks=()):
+        from collections import deque
+
+        distances = dict.fromkeys(start_ids, 0)
+        networks_crossed = {id(network): network for network in start_networks}
+        queue = deque(start_ids)
+
+        while queue:
+            node_id = queue.popleft()
+            distance = distances[node_id]
+            if distance >= hops:
+                continue
+
+            neighbour_ids = [edge['destination'] if edge['source'] == node_id else edge['source']
+                             for edge in self.edges_of.get(node_id, [])]
+            for network in self.networks_of.get(node_id, []):
+                if id(network) not in networks_crossed:
+                    networks_crossed[id(network)] = network
+                    neighbour_ids.extend(network['ports'])
+
+            for neighbour_id in neighbour_ids:
+                if neighbour_id not in distances:
+                    distances[neighbour_id] = distance + 1
+                    queue.append(neighbour_id)
+
+        return distances, list(networks_crossed.values())
+
+
+# Parse a focus given as name=value (or just a name, meaning name=value) into its name and value
+def parse_focus(focus):
+    param, separator, value = focus.partition("=")
+    if not separator:
+        return "name", focus.strip()
+    return param.strip(), value.strip()
+
+
+# Return the IDs of the VMs and ports a focus starts from: the shapes whose label has the focus's name=value pair,
+# or for a network, the ports attached to it. Also returns the networks the focus matched. The name and id of a
+# shape are looked up in the graph's indexes; any other parameter needs a search through the shapes
+def find_focus(focus, graph, index):
+    param, value = parse_focus(focus)
+    if param == "name":
+        shapes = graph.get_shapes_by_name(value)
+    elif param == "id":
+        shape = graph.get_shape_by_id(value)
+        shapes = [shape] if shape is not None else []
+    else:
+        shapes = [shape for shape in graph.shapes if matches_parameter_value_pair(shape, param, value)]
+
+    start_ids = []
+    networks = {}
+    for shape in shapes:
+        if is_a_network(shape):
+            network = index.network_by_shape_id.get(shape['id'])
+            if network is not None:
+                start_ids.extend(network['ports'])
+                networks[id(network)] = network
+        else:
+            start_ids.append(shape['id'])
+
+    if not start_ids:
+        raise Exception(f"Nothing in the diagram matches the focus {focus}")
+
+    return list(dict.fromkeys(start_ids)), list(networks.values())
+
+
+# Cut the compiled nodes, edges and networks of a diagram down to the neighbourhood of the focus: the VMs and ports
+# within the given number of hops of it, the edges between them, and the networks joining them, each of which is
+# left with only the ports in the neighbourhood. Like the edges, a network is kept whenever two or more of its ports
+# are in the neighbourhood, whether or not it was crossed to reach them. Apart from building the index, the work
+# done depends only on the size of the neighbourhood
+def focus_on_neighbourhood(focus, hops, non_network_nodes, non_network_edges, network_connectors, graph):
+    index = adjacency_index(non_network_edges, network_connectors)
+    start_ids, start_networks = find_focus(focus, graph, index)
+    distances, _ = index.neighbourhood(start_ids, hops, start_networks)
+
+    nodes = []
+    edges = {}
+    networks = {}
+    for node_id in distances:
+        node = graph.get_shape_by_id(node_id)
+        if node is not None and (is_a_vm(node) or is_a_port(node)):
+            nodes.append(node)
+        for edge in index.edges_of.get(node_id, []):
+            if edge['source'] in distances and edge['destination'] in distances:
+                edges[id(edge)] = edge
+        for network in index.networks_of.get(node_id, []):
+            if id(network) not in networks:
+                ports = [port_id for port_id in network['ports'] if port_id in distances]
+                networks[id(network)] = dict(network, ports=ports) if len(ports) > 1 else None
+
+    networks = [network for network in networks.values() if network is not None]
+
+    return nodes, list(edges.values()), networks
 
 
 # Return a list of virtual machines and ports
@@ -361,12 +1066,12 @@ def get_all_vm_and_port_nodes(scanned_shapes):
 
 # Return a lost of all the connectors in the network diagram that join vm's to ports. These connectors
 # are used to devine which NICs (ports) belong to each virtual machine
-def get_all_vm_to_port_edges(scanned_connectors, scanned_shapes):
+def get_all_vm_to_port_edges(scanned_connectors, graph):
 
     list_of_non_network_edges = []
     for connector in scanned_connectors:
         # Lookup the actual source and dest objects from their IDs held in the connector object
-        source, dest = get_source_and_dest(connector, scanned_shapes)
+        source, dest = get_source_and_dest(connector, graph)
 
         # If neither end of the connector is a network, add this to the list of non-network edges
         if not is_a_network(source) and not is_a_network(dest):
@@ -377,127 +1082,120 @@ def get_all_vm_to_port_edges(scanned_connectors, scanned_shapes):
 
 # Powerpoint can be a bit untidy at times and it's possible that some extra paragraps, empty lines and preceding
 # spaces are present in the files. We want to strip out this kind of stuff to get a clean list of comma separated
-# name-value pairs that we can use to configure up our vm's and other objects
-def tidy_text(text):
-    lines = text.split('\n')
+# name-value pairs that we can use to configure up our vm's and other objects. Returns the lines with any literal \n
+# sequences removed, runs of whitespace collapsed to single spaces, and blank lines dropped
+def normalise_label_lines(lines):
     cleaned_lines = []
-    print(f"split lines = {lines}")
     for line in lines:
-        line = line.replace('\\n', '')
-        line = line.strip()
+        line = " ".join(line.replace('\\n', '').split())
 
         # If there's anything left on the line by this stage add it to a new list
-        if len(line) > 0:
+        if line:
             cleaned_lines.append(line)
 
-    cleaned_line = '\\n'.join(cleaned_lines)
-    return cleaned_line
+    return cleaned_lines
+
+
+# Return the text of a label tidied up into a single line, with its lines separated by \n sequences
+def tidy_text(text):
+    return '\\n'.join(normalise_label_lines(text.split('\n')))
+
+
+# Return text escaped for use within a double quoted string in a .dot file
+def escape_dot_text(text):
+    if '\\' in text or '"' in text:
+        text = text.replace('\\', '\\\\').replace('"', '\\"')
+    return text
+
+
+# Return the label of a shape or network tidied up and escaped for use in the .dot file. This is worked out once per
+# object and kept on it, as the same label can be needed more than once
+def get_dot_label(node):
+    dot_label = node.get('dot_label')
+    if dot_label is None:
+        dot_label = '\\n'.join(escape_dot_text(line) for line in normalise_label_lines(node['label'].split('\n')))
+        node['dot_label'] = dot_label
+
+    return dot_label
+
+
+# Return the name of a shape escaped for use as a node name in the .dot file: its name=, or its draw:id if it doesn't
+# have one. Like the label, this is worked out once per shape
+def get_dot_name(node):
+    dot_name = node.get('dot_name')
+    if dot_name is None:
+        name = get_object_parameter(node, "name")
+        dot_name = escape_dot_text(name if name is not None else node['id'])
+        node['dot_name'] = dot_name
+
+    return dot_name
 
 
 # Generate and return a string that constitutes a single line of a graphviz (.dot) file defining a node.
-# By calling this function repeatedly and appending the strings created to a lager body of text, we can
+# By calling this function repeatedly and writing the strings created to a dot_writer, we can
 # build up the .dot file line by line
 def add_graphviz_node(node):
 
-    node_name = get_object_parameter(node, "name")
-    if node_name is None:
-        node_name = node['id']
-
+    node_name = get_dot_name(node)
     node_shape = node['shape']
-    node_label = node['label']
-    print(f'Node = "{node_name}"[shape = {node_shape}, label = "{tidy_text(node_label)}"]\n')
-    return f'  "{node_name}"[shape = {node_shape}, label = "{tidy_text(node_label)}"]\n'
+    node_label = get_dot_label(node)
+    node_line = f'  "{node_name}"[shape = {node_shape}, label = "{node_label}"]\n'
+    logger.debug("Node = %s", node_line.strip())
+    return node_line
 
 
 # Create and return a string containing the lines of a .dot file required to define all the
 # vm nodes and all the port nodes of the network
 def add_non_network_graphviz_nodes(non_network_nodes):
-    result = ""
-
-    for node in non_network_nodes:
-        result += add_graphviz_node(node)
-
-    return result
+    return "".join(add_graphviz_node(node) for node in non_network_nodes)
 
 
 # Generate and return a string that constitutes a single line of a graphviz (.dot) file defining an unlabelled edge.
-# By calling this function repeatedly and appending the strings created to a lager body of text, we can
+# By calling this function repeatedly and writing the strings created to a dot_writer, we can
 # build up the .dot file line by line
-def add_graphviz_edge(edge, scanned_shapes):
-
-    source, dest = get_source_and_dest(edge, scanned_shapes)
-    edge_source_name = get_object_parameter(source, "name")
-    if edge_source_name is None:
-        edge_source_name = source['id']
-
-    edge_destination_name = get_object_parameter(dest, "name")
-    if edge_destination_name is None:
-        edge_destination_name = dest['id']
+def add_graphviz_edge(edge, graph):
 
-    return f'  "{edge_source_name}" -- "{edge_destination_name}"\n'
+    source, dest = get_source_and_dest(edge, graph)
+    return f'  "{get_dot_name(source)}" -- "{get_dot_name(dest)}"\n'
 
 
 # Create and return a string containing the lines of a .dot file required to define all the
 # unlabelled edges of the network. These edges join ports to the vm's that own them
-def add_non_network_graphviz_edges(non_network_edges, scanned_shapes):
-    result = ""
-
-    for edge in non_network_edges:
-        result += add_graphviz_edge(edge, scanned_shapes)
-
-    return result
+def add_non_network_graphviz_edges(non_network_edges, graph):
+    return "".join(add_graphviz_edge(edge, graph) for edge in non_network_edges)
 
 
 # Generate and return a string that constitutes a single line of a graphviz (.dot) file defining a labelled edge.
-# By calling this function repeatedly and appending the strings created to a lager body of text, we can
+# By calling this function repeatedly and writing the strings created to a dot_writer, we can
 # build up the .dot file line by line
-def add_graphviz_network_edge(network, scanned_shapes):
+def add_graphviz_network_edge(network, graph):
 
-    result = ""
+    port_names = []
 
     # For each port in the list of ports contained in that object
     for port_id in network['ports']:
 
-        # Look up the port object from its ID in the port list and get its name
-        port_index = find_on_list_by_id(scanned_shapes, port_id)
-        if port_index is None:
-            raise Exception(f"Could not find port % in system")
-        port = scanned_shapes[port_index]
-        port_name = get_object_parameter(port, "name")
-        if port_name is None:
-            port_name = port_id
-
-        # Connect them all together:
-
-        if result == "":
-            # Start of the line, first port
-            result += "  "
-        else:
-            # Continuing a line, appending ports
-            result += " -- "
+        # Look up the port object from its ID in the graph and get its name
+        port = graph.get_shape_by_id(port_id)
+        if port is None:
+            raise Exception(f"Could not find port {port_id} in system")
 
         # Add the name of the port
-        result += f'"{port_name}"'
+        port_names.append(f'"{get_dot_name(port)}"')
 
-    # Add the network object label
-    label = tidy_text(network['label'])
-    result += f' [label="{label}"] \n'
-
-    return result
+    # Connect them all together, then add the network object label
+    result = "  " + " -- ".join(port_names) if port_names else ""
+    label = get_dot_label(network)
+    return f'{result} [label="{label}"] \n'
 
 
 # Create and return a string containing the lines of a .dot file required to define all the
 # labelled edges of the network. These edges join ports to other ports and represent the networks.
 # Each of these links is labelled with the name of the network. It is possible to have several
 # edges with the same name. All edges with the same name will be considered logically joined.
-def add_network_graphviz_edges(network_connectors):
-    result = ""
-
-    print(f"network_connectors {network_connectors}")
-    for object in network_connectors:
-        result += add_graphviz_network_edge(object, scanned_shapes)
-
-    return result
+def add_network_graphviz_edges(network_connectors, graph):
+    logger.debug("network_connectors %s", network_connectors)
+    return "".join(add_graphviz_network_edge(object, graph) for object in network_connectors)
 
 
 # Return a string that constitutes the header of a graphviz .dot file
@@ -510,90 +1208,988 @@ def add_dot_closer():
     return "}"
 
 
-''' Below are the steps  required to generate the .dot file'''
+# Return a string that opens the cluster drawn around a vm and its ports, named and labelled after the vm
+def add_cluster_header(vm):
+    vm_name = get_dot_name(vm)
+    return f'  subgraph "cluster_{vm_name}" {{\n    label = "{vm_name}"\n'
 
-# =====================================================================
-print("STEP 0: READING THE OPEN DOCUMENT FORMAT SAVED POWERPOINT FILE")
-# =====================================================================
 
-#name_of_xml_content_file = 'SimpleNetwork2.xml'
-name_of_odf_powerpoint_file = 'FourNodeExample.odp'
+# Return a string that closes a cluster
+def add_cluster_closer():
+    return "  }\n"
 
-# Open the xml file that contains the main contents of the PowerPoint.
-#data_as_string = read_the_extracted_xml_file(name_of_xml_content_file)  # test and dev purpposes
 
-# Open the ODF file saved from PowerPoint.
-data_as_string = read_odf_file(name_of_odf_powerpoint_file)
-print(data_as_string)
+# Writes a .dot file to any text sink with a write method (an open file, sys.stdout, a socket's makefile, ...) as
+# its lines are generated, so the whole file is never held in memory. Lines are collected into blocks of around
+# buffer_size characters before being written, to keep the number of writes down on unbuffered sinks
+class dot_writer:
+
+    def __init__(self, sink, buffer_size=1 << 16):
+        self._sink = sink
+        self._buffer_size = buffer_size
+        self._pieces = []
+        self._length = 0
+
+    # Write some text to the .dot file
+    def write(self, text):
+        self._pieces.append(text)
+        self._length += len(text)
+        if self._length >= self._buffer_size:
+            self.flush()
+
+    # Write out anything waiting in the buffer
+    def flush(self):
+        if self._pieces:
+            self._sink.write("".join(self._pieces))
+            self._pieces = []
+            self._length = 0
+
+    # Write a whole graph: the header, the vm and port nodes, the unlabelled edges that connect vm's to the ports
+    # they own, the labelled edges that represent networks and the closer. When clusters is set, each vm is written
+    # in a cluster along with its ports
+    def write_graph(self, non_network_nodes, non_network_edges, network_connectors, graph, clusters=False):
+        self.write(add_dot_header())
+
+        if clusters:
+            vm_clusters_found, non_network_nodes = vm_clusters(non_network_nodes, non_network_edges)
+            for vm, ports in vm_clusters_found:
+                self.write(add_cluster_header(vm))
+                for node in [vm] + ports:
+                    self.write("  " + add_graphviz_node(node))
+                self.write(add_cluster_closer())
+
+        for node in non_network_nodes:
+            self.write(add_graphviz_node(node))
+
+        for edge in non_network_edges:
+            self.write(add_graphviz_edge(edge, graph))
+
+        logger.debug("network_connectors %s", network_connectors)
+        for network in network_connectors:
+            self.write(add_graphviz_network_edge(network, graph))
+
+        self.write(add_dot_closer())
+        self.flush()
+
+
+# Writes the same text to two sinks, for example to the output file and the cache at the same time
+class _tee_sink:
+
+    def __init__(self, first, second):
+        self._first = first
+        self._second = second
+
+    def write(self, text):
+        self._first.write(text)
+        self._second.write(text)
+
+
+# The values of type= that the converter understands
+KNOWN_TYPES = ("vm", "port", "net")
+
+
+# Return a validation diagnostic: a problem found in the diagram, with its severity ("error" for problems that stop
+# the diagram being converted correctly, "warning" for ones that are probably mistakes), a short code naming the kind
+# of problem, the draw:id of the shape or connector it was found on, and a description
+def diagnostic(severity, code, object_id, message):
+    return {'severity': severity, 'code': code, 'id': object_id, 'message': message}
+
+
+# Check a graph scanned with tolerant set for everything that could go wrong in converting it, returning a list of
+# every diagnostic found rather than stopping at the first. Along with the problems found while scanning (bad
+# labels, missing and repeated IDs and unattached connectors), this finds names used by more than one VM or port, unknown types,
+# connectors attached to shapes that aren't in the diagram, VMs connected directly to each other and ports that
+# aren't attached to a VM. It makes a single pass over the shapes and one over the connectors, looking everything up
+# in the graph's indexes
+def validate_graph(graph):
+
+    diagnostics = list(graph.problems)
+
+    shapes_by_name = {}
+    for shape in graph.shapes:
+        if shape['type'] is not None and shape['type'] not in KNOWN_TYPES:
+            diagnostics.append(diagnostic("warning", "unknown_type", shape['id'],
+                                          f"type={shape['type']} is not one of {', '.join(KNOWN_TYPES)}"))
+        if shape['name'] is not None:
+            shapes_by_name.setdefault(shape['name'], []).append(shape)
+
+    # Networks drawn more than once share a name, but any other shapes sharing a name would be drawn as one node
+    for name, shapes in shapes_by_name.items():
+        if len(shapes) > 1 and not all(is_a_network(shape) for shape in shapes):
+            for shape in shapes[1:]:
+                diagnostics.append(diagnostic("error", "duplicate_name", shape['id'],
+                                              f"name={name} is also used by {shapes[0]['id']}"))
+
+    ports_with_vm = set()
+    for connector in graph.connectors:
+        if connector['source'] is None or connector['destination'] is None:
+            continue
+
+        source, dest = get_source_and_dest(connector, graph, allow_missing=True)
+        if source is None or dest is None:
+            missing = connector['source'] if source is None else connector['destination']
+            diagnostics.append(diagnostic("error", "dangling_connector", connector['id'],
+                                          f"connector is attached to {missing}, which is not in the diagram"))
+            continue
+
+        if is_a_vm(source) and is_a_vm(dest):
+            diagnostics.append(diagnostic("warning", "vm_to_vm_link", connector['id'],
+                                          f"connector joins two VMs ({source['id']} and {dest['id']}) directly, "
+                                          f"instead of through their ports"))
+        elif is_a_vm(source) and is_a_port(dest):
+            ports_with_vm.add(dest['id'])
+        elif is_a_port(source) and is_a_vm(dest):
+            ports_with_vm.add(source['id'])
+
+    for port in graph.get_shapes_by_type("port"):
+        if port['id'] not in ports_with_vm:
+            diagnostics.append(diagnostic("warning", "port_without_vm", port['id'], "port is not attached to a VM"))
+
+    return diagnostics
+
+
+# Scan the diagram in an ODF file, tolerating any problems found, and validate it without generating a .dot file.
+# Returns the list of diagnostics found. See convert_to for the arguments
+def validate_odf_file(odf_file, streaming_ingest=True, stats=None, all_pages=False):
+
+    if stats is None:
+        stats = conversion_stats()
+
+    graph = network_graph(tolerant=True)
+    scan_diagram(odf_file, graph, streaming_ingest, stats, all_pages)
+
+    with stats.stage("validate"):
+        diagnostics = validate_graph(graph)
+
+    stats.count("shapes", len(graph.shapes))
+    stats.count("connectors", len(graph.connectors))
+    stats.count("diagnostics", len(diagnostics))
+    return diagnostics
+
+
+# Return the diagnostics as human-readable text, one per line, followed by a count of the errors and warnings
+def format_diagnostics(diagnostics):
+    lines = [f"{item['severity']}: {item['id']}: {item['message']} [{item['code']}]" for item in diagnostics]
+    errors = sum(1 for item in diagnostics if item['severity'] == "error")
+    lines.append(f"{errors} error{'' if errors == 1 else 's'}, {len(diagnostics) - errors} "
+                 f"warning{'' if len(diagnostics) - errors == 1 else 's'}")
+    return "\n".join(lines) + "\n"
+
+
+# Below are the steps required to generate the .dot file. Everything needed by a conversion is held within the
+# call, so conversions can be run one after another or side by side, and importing this module does no work.
+#
+# The ODF file can be given as a file name or as an open binary file object, and the .dot file is written to sink,
+# which can be anything with a write method taking a string. When streaming_ingest is set, the shapes and
+# connectors are streamed straight out of the ODF file as it is decompressed and parsed, instead of reading the
+# whole document into memory first (steps 0 to 2 happen together). Only the first page is read, unless all_pages
+# is set, in which case the contents of every page are merged into one network diagram. Unless merge_networks is
+# turned off, network shapes with the same name are merged into a single logical network. When clusters is set,
+# each VM is drawn in a cluster along with its ports. When a focus is given, as a name=value pair such as
+# name=web01, only the neighbourhood of the objects it matches is written: the VMs and ports within hops edges of
+# them. The time taken by each step, and counts of what was found, are recorded in stats if one is given
+def convert_to(odf_file, sink, streaming_ingest=True, stats=None, all_pages=False, merge_networks=True,
+               clusters=False, focus=None, hops=1):
+
+    if stats is None:
+        stats = conversion_stats()
+
+    # The graph holds the scanned shapes and connectors, indexed for lookup by the later steps
+    graph = network_graph()
+
+    scan_diagram(odf_file, graph, streaming_ingest, stats, all_pages)
+    write_graph_to(graph, sink, stats, merge_networks, clusters, focus, hops)
+
+
+# Steps 0 to 2 of a conversion: read the shapes and connectors of the diagram in the ODF file into the graph. See
+# convert_to for the arguments. A graph snapshot (see graph_snapshot.py) can be given instead of an ODF file, in which
+# case the graph is loaded from it as it was scanned, and the pages it was scanned from are fixed
+def scan_diagram(odf_file, graph, streaming_ingest=True, stats=None, all_pages=False):
+
+    # A named file is opened once, to tell whether it is a snapshot and then to read it
+    if not hasattr(odf_file, "read"):
+        with open(odf_file, "rb") as opened_file:
+            return scan_diagram(opened_file, graph, streaming_ingest, stats, all_pages)
+
+    if stats is None:
+        stats = conversion_stats()
+
+    if is_graph_snapshot(odf_file):
+        # =====================================================================
+        logger.info("STEPS 0 TO 2: LOADING THE SHAPES AND CONNECTORS FROM A SNAPSHOT")
+        # =====================================================================
+
+        from graph_snapshot import load_snapshot
+
+        with stats.stage("load_snapshot"):
+            add_compact_graph(load_snapshot(odf_file), graph)
+
+    elif streaming_ingest:
+        # =====================================================================
+        logger.info("STEPS 0 TO 2: STREAMING THE SHAPES AND CONNECTORS FROM THE DIAGRAM")
+        # =====================================================================
+
+        # Decompressing the document and parsing it happen together, so the time spent reading from the zip member
+        # is measured as it goes and recorded as a step of its own
+        content_timer = read_timer()
+        with stats.stage("parse_and_scan") as stage:
+            scanned_shapes, scanned_connectors = scan_odf_file(odf_file, graph, all_pages, content_timer)
+            stage.exclude(content_timer.seconds)
+        stats.add_stage("decompress", content_timer.seconds)
+        logger.debug("scanned_shapes = %s", scanned_shapes)
+        logger.debug("scanned_connectors = %s", scanned_connectors)
+
+    else:
+        # =====================================================================
+        logger.info("STEP 0: READING THE OPEN DOCUMENT FORMAT SAVED POWERPOINT FILE")
+        # =====================================================================
+
+        # Open the ODF file saved from PowerPoint.
+        with stats.stage("read_odf"):
+            data_as_string = read_odf_file(odf_file)
+        logger.debug("%s", data_as_string)
+
+        # Read the root node of the XML document, from which we can then dive down to the first page on which we
+        # expect to find the network diagram of interest. The namespace information is read out of XML the document
+        # at the same time. We'll use this when searching for tags later
+        with stats.stage("parse_xml"):
+            root, ns = parse_xml_data(data_as_string)
+
+        # =====================================================================
+        logger.info("STEP 1: OPENING UP THE DOCUMENT AND GETTING TO THE RIGHT PAGES")
+        # =====================================================================
+
+        # Delve down into the document and pull out the pages containing the network diagram
+        with stats.stage("find_page"):
+            pages = get_pages_from_powerpoint_data(root, ns, all_pages)
+
+        # =====================================================================
+        logger.info("STEP 2: SCANNING IN THE SHAPES AND CONNECTORS FROM THE DIAGRAM")
+        # =====================================================================
+
+        # Extract the relevant information from the nodes and the unlabelled connectors in a single pass
+        with stats.stage("scan"):
+            scanned_shapes, scanned_connectors = scan_pages(pages, graph, ns)
+
+        logger.debug("scanned_shapes = %s", scanned_shapes)
+        logger.debug("scanned_connectors = %s", scanned_connectors)
+
+    logger.debug("label_parses = %d", graph.label_parses)
+
+
+# Step 3 of a conversion: compile the networks, VMs and ports of a scanned graph, returning the lists of VM and port
+# nodes, of the edges joining them and of the networks. See convert_to for the arguments
+def compile_graph(graph, stats=None, merge_networks=True, focus=None, hops=1):
+
+    if stats is None:
+        stats = conversion_stats()
+
+    scanned_shapes, scanned_connectors = graph.shapes, graph.connectors
+
+    # =====================================================================
+    logger.info("STEP 3: COMPILING A LIST OF NETWORKS, VM'S AND PORTS")
+    # =====================================================================
+
+    with stats.stage("compile_networks"):
+        # Extract the relevant information from the labelled connectors, unless it has been worked out already
+        network_connectors = graph.compiled_networks.get(merge_networks)
+        if network_connectors is not None:
+            network_shapes = sum(len(network.get('merged_ids', [network['id']])) for network in network_connectors)
+        else:
+            network_connectors = get_networks(scanned_connectors, graph)
+            network_shapes = len(network_connectors)
+
+            # Join up networks that are drawn more than once into a single logical network
+            if merge_networks:
+                network_connectors = merge_logical_networks(network_connectors, scanned_connectors, graph)
+
+        # Extract the relevant information from the vm and port nodes
+        non_network_nodes = get_all_vm_and_port_nodes(scanned_shapes)
+
+        # Compiling a list of non-network connectors (port-to-vm)
+        non_network_edges = get_all_vm_to_port_edges(scanned_connectors, graph)
+
+    stats.count("shapes", len(scanned_shapes))
+    stats.count("connectors", len(scanned_connectors))
+    stats.count("network_shapes", network_shapes)
+    stats.count("networks", len(network_connectors))
+    stats.count("label_parses", graph.label_parses)
+
+    if focus is not None:
+        with stats.stage("focus"):
+            non_network_nodes, non_network_edges, network_connectors = focus_on_neighbourhood(
+                focus, hops, non_network_nodes, non_network_edges, network_connectors, graph)
+        stats.count("focus_nodes", len(non_network_nodes))
+
+    return non_network_nodes, non_network_edges, network_connectors
+
+
+# Steps 3 and 4 of a conversion: compile the networks, VMs and ports of a scanned graph and write the .dot file to
+# sink. See convert_to for the arguments
+def write_graph_to(graph, sink, stats=None, merge_networks=True, clusters=False, focus=None, hops=1):
+
+    if stats is None:
+        stats = conversion_stats()
+
+    non_network_nodes, non_network_edges, network_connectors = compile_graph(graph, stats, merge_networks, focus,
+                                                                             hops)
+
+    # =========================================================================
+    logger.info("STEP 4: WRITE OUT THE TEXT OF THE GRAPHVIZ FILE FROM COLLECTED INFO")
+    # =========================================================================
+
+    with stats.stage("write_dot"):
+        # Write the header, the vm and port nodes, the unlabelled edges that connect vm's to ports that they own,
+        # and the labelled edges that represent networks that connect ports to other ports
+        dot_writer(sink).write_graph(non_network_nodes, non_network_edges, network_connectors, graph, clusters)
+
+    stats.count("lookups", graph.lookups)
+
+
+# Steps 3 and 4 of a conversion, writing each connected component of the diagram as a separate graph, so that the
+# components can be laid out independently (and side by side). sink_for is called with the number of each component,
+# counting from 1, and returns the text sink to write it to. Returns the number of components. See convert_to for
+# the other arguments
+def write_component_graphs(graph, sink_for, stats=None, merge_networks=True, clusters=False, focus=None, hops=1):
+
+    if stats is None:
+        stats = conversion_stats()
+
+    non_network_nodes, non_network_edges, network_connectors = compile_graph(graph, stats, merge_networks, focus,
+                                                                             hops)
+
+    # =========================================================================
+    logger.info("STEP 4: WRITE OUT THE TEXT OF A GRAPHVIZ FILE FOR EACH CONNECTED COMPONENT")
+    # =========================================================================
+
+    with stats.stage("write_dot"):
+        components = connected_components(non_network_nodes, non_network_edges, network_connectors)
+        for number, (nodes, edges, networks) in enumerate(components, start=1):
+            dot_writer(sink_for(number)).write_graph(nodes, edges, networks, graph, clusters)
+
+    stats.count("components", len(components))
+    stats.count("lookups", graph.lookups)
+    return len(components)
+
+
+# Convert an ODF file (a file name or an open binary file object) and return the text of the .dot file. See
+# convert_to, which this wraps, for the other arguments
+def convert(odf_file, streaming_ingest=True, stats=None, all_pages=False, merge_networks=True, clusters=False,
+            focus=None, hops=1):
+    from io import StringIO
+
+    sink = StringIO()
+    convert_to(odf_file, sink, streaming_ingest=streaming_ingest, stats=stats, all_pages=all_pages,
+               merge_networks=merge_networks, clusters=clusters, focus=focus, hops=hops)
+    result = sink.getvalue()
+
+    # Show the results file
+    logger.debug("\nAutomatically generated graphviz specification:\n\n%s\n", result)
+
+    return result
+
+
+# Convert an ODF file as convert_to does, but write each connected component of the diagram to its own .dot file,
+# named after spec_filename with the number of the component added (specification_1.dot, specification_2.dot, ...).
+# The files of components beyond the last, left by an earlier conversion, are removed.
+# Any other options are passed on to write_component_graphs. Returns the list of the names of the files written
+def convert_components(odf_file, spec_filename, streaming_ingest=True, stats=None, all_pages=False, **options):
+    import os
+
+    graph = network_graph()
+    scan_diagram(odf_file, graph, streaming_ingest, stats, all_pages)
+
+    # Each component is written out in full before the next is started, so only one file needs to be open at a time
+    base_name, extension = os.path.splitext(spec_filename)
+    spec_filenames = []
+    open_file = []
+
+    def sink_for(number):
+        if open_file:
+            open_file.pop().commit()
+        spec_filenames.append(f"{base_name}_{number}{extension}")
+        open_file.append(_replacing_file(spec_filenames[-1]))
+        return open_file[-1].open()
+
+    try:
+        write_component_graphs(graph, sink_for, stats, **options)
+    except BaseException:
+        if open_file:
+            open_file.pop().discard()
+        raise
+    if open_file:
+        open_file.pop().commit()
+
+    # Remove the files of any further components left by an earlier run, so they aren't taken as part of this one
+    number = len(spec_filenames) + 1
+    while os.path.exists(f"{base_name}_{number}{extension}"):
+        os.remove(f"{base_name}_{number}{extension}")
+        number += 1
+
+    return spec_filenames
+
+
+# Convert an ODF file as convert_to does, but first look for the result in a conversion_cache (see
+# conversion_cache.py), and store it there afterwards. The cache is keyed on the content of the presentation, so a
+# presentation that hasn't changed since it was last converted is not decompressed or parsed at all. The .dot file
+# is copied to or from the cache as it is written, rather than being held in memory. Any options are passed on to
+# convert_to, and those that change the output form part of the cache key
+def convert_cached_to(odf_file, sink, cache, stats=None, **options):
+
+    # A named file is opened once, to tell whether it is a snapshot, to look it up in the cache and to convert it
+    if not hasattr(odf_file, "read"):
+        with open(odf_file, "rb") as opened_file:
+            return convert_cached_to(opened_file, sink, cache, stats, **options)
+
+    if stats is None:
+        stats = conversion_stats()
+
+    # Snapshots load faster than the cache could be checked, so they are always converted
+    if is_graph_snapshot(odf_file):
+        convert_to(odf_file, sink, stats=stats, **options)
+        return
 
-# Read the namespace information out of XML the document. We'll use this when searching for tags later
-ns = namespace(data_as_string)
+    with stats.stage("cache_lookup"):
+        key = cache.key_for(odf_file, __version__, output_options(options))
+        hit = cache.copy_to(key, sink)
+    stats.count("cache_hit", int(hit))
 
-# Read the root node of the XML document, from which we can then dive down to the first page on which we
-# expect to find the network diagram of interest
-root = ET.fromstring(data_as_string)
+    if not hit:
+        with cache.open_entry(key) as entry:
+            convert_to(odf_file, _tee_sink(sink, entry), stats=stats, **options)
 
-# =====================================================================
-print("STEP 1: OPENING UP THE DOCUMENT AND GETTING TO THE RIGHT PAGE")
-# =====================================================================
 
-# Delve down into the document and pull out the page containing the network diagram
-page = get_page_from_powerpoint_data(root)
+# A .dot file being written. It is written to a temporary file which replaces the named file when complete, so a
+# conversion that fails part way through leaves any earlier .dot file as it was rather than half written. Use in a
+# with statement, which gives the text file to write to, or call open and then commit or discard
+class _replacing_file:
 
-# =====================================================================
-print("STEP 2: SCANNING IN THE SHAPES AND CONNECTORS FROM THE DIAGRAM")
-# =====================================================================
+    def __init__(self, file_name):
+        import os
 
-# Extract the relevant information from the nodes
-scanned_shapes = get_shapes(page)
-print(f"scanned_shapes = {scanned_shapes}")
+        self._file_name = file_name
+        self._temp_file_name = f"{file_name}.{os.getpid()}.{id(self)}.tmp"
 
-# Extract the relevant information from the unlabelled connectors
-scanned_connectors = get_connectors(page)
-print(f"scanned_connectors = {scanned_connectors}")
+    # Open the temporary file and return it
+    def open(self):
+        self._file = open(self._temp_file_name, "wt")
+        return self._file
 
-# =====================================================================
-print("STEP 3: COMPILING A LIST OF NETWORKS, VM'S AND PORTS")
-# =====================================================================
+    # Close the temporary file and put it in place of the named file
+    def commit(self):
+        import os
 
-# Extract the relevant information from the labelled connectors
-network_connectors = get_networks(scanned_connectors, scanned_shapes)
+        self._file.close()
+        os.replace(self._temp_file_name, self._file_name)
 
-# Extract the relevant information from the vm and port nodes
-non_network_nodes = get_all_vm_and_port_nodes(scanned_shapes)
+    # Close the temporary file and throw it away, leaving the named file as it was
+    def discard(self):
+        import os
 
-# Compiling a list of non-network connectors (port-to-vm)
-non_network_edges = get_all_vm_to_port_edges(scanned_connectors, scanned_shapes)
+        self._file.close()
+        os.remove(self._temp_file_name)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+
+# Convert an ODF file using a cache and return the text of the .dot file. See convert_cached_to
+def convert_cached(odf_file, cache, stats=None, **options):
+    from io import StringIO
+
+    sink = StringIO()
+    convert_cached_to(odf_file, sink, cache, stats=stats, **options)
+    return sink.getvalue()
+
+
+# Return the conversion options that change the .dot output, as sorted name=value strings. The way the document
+# is read (streaming_ingest) makes no difference to the result, so it is left out
+def output_options(options):
+    return [f"{name}={value}" for name, value in sorted(options.items()) if name != 'streaming_ingest']
+
+
+# Return the conversion_cache to use for a conversion, or None when the cache is switched off (no directory given)
+def open_cache(cache_dir, cache_max_bytes=None):
+    if cache_dir is None:
+        return None
+
+    from conversion_cache import conversion_cache, DEFAULT_MAX_BYTES
+    return conversion_cache(cache_dir, cache_max_bytes if cache_max_bytes is not None else DEFAULT_MAX_BYTES)
+
+
+# Convert a single ODF file and write the graphviz specification to the named .dot file, using the cache in
+# cache_dir if one is given. Batch conversions run this in worker processes, so it only takes and returns simple
+# values. Any options are passed on to convert_to. Returns the name of the file written
+def convert_file(odf_file_name, spec_filename, cache_dir=None, cache_max_bytes=None, **options):
+    cache = open_cache(cache_dir, cache_max_bytes)
+    with _replacing_file(spec_filename) as text_file:
+        if cache is not None:
+            convert_cached_to(odf_file_name, text_file, cache, **options)
+        else:
+            convert_to(odf_file_name, text_file, **options)
+
+    return spec_filename
+
+
+# Expand a list of file names and glob patterns into the list of files they name, in order and without repeats.
+# Patterns that match nothing are kept as they are, so that the missing file is reported when it is converted
+def expand_input_paths(paths):
+    import glob
+
+    expanded = {}
+    for path in paths:
+        matches = sorted(glob.glob(path)) if glob.has_magic(path) else []
+        for match in matches or [path]:
+            expanded[match] = None
+
+    return list(expanded)
+
+
+# Return the name of the .dot file to write for an ODF file in a batch: the same name with a .dot extension, in the
+# output directory if one is given, or alongside the ODF file if not
+def batch_output_path(odf_file_name, output_dir=None):
+    import os
+
+    spec_filename = os.path.splitext(odf_file_name)[0] + ".dot"
+    if output_dir is not None:
+        spec_filename = os.path.join(output_dir, os.path.basename(spec_filename))
+
+    return spec_filename
+
+
+# Convert many ODF files, each to its own .dot file, spreading the work across a pool of worker processes (jobs of
+# None uses one per CPU, and 1 converts them one after another in this process). A file that fails to convert does
+# not stop the rest. Unchanged files are taken from the cache in cache_dir, if one is given. Any options are passed
+# on to convert_to. Returns a list of the (ODF file, .dot file) pairs converted and a list of the (ODF file, error
+# message) pairs that failed
+def convert_batch(odf_file_names, output_dir=None, jobs=None, cache_dir=None, cache_max_bytes=None, **options):
+    import os
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    outputs = {odf_file_name: batch_output_path(odf_file_name, output_dir) for odf_file_name in odf_file_names}
+    if len(set(outputs.values())) < len(outputs):
+        raise Exception("More than one of the files being converted would be written to the same .dot file")
+
+    converted = []
+    failures = []
+
+    if jobs == 1:
+        for odf_file_name, spec_filename in outputs.items():
+            try:
+                converted.append((odf_file_name, convert_file(odf_file_name, spec_filename, cache_dir,
+                                                              cache_max_bytes, **options)))
+            except Exception as e:
+                failures.append((odf_file_name, f"{type(e).__name__}: {e}"))
+                logger.info("Failed to convert %s: %s", odf_file_name, e)
+
+        return converted, failures
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(convert_file, odf_file_name, spec_filename, cache_dir, cache_max_bytes,
+                               **options): odf_file_name
+                   for odf_file_name, spec_filename in outputs.items()}
+
+        for future, odf_file_name in futures.items():
+            try:
+                converted.append((odf_file_name, future.result()))
+                logger.info("Converted %s", odf_file_name)
+            except Exception as e:
+                failures.append((odf_file_name, f"{type(e).__name__}: {e}"))
+                logger.info("Failed to convert %s: %s", odf_file_name, e)
+
+    return converted, failures
+
+
+# Return the differences in topology between two scanned graphs, matching shapes and connectors by their draw:id.
+# Shapes whose label has changed, and connectors whose ends have moved, count as changed. Either graph may be None,
+# standing for an empty diagram. Returns a dictionary of the added, removed and changed IDs of the shapes and of the
+# connectors, each in the order they appear in the diagram
+def topology_changes(old_graph, new_graph):
+    changes = {}
+    for kind, key in (('shapes', lambda shape: shape['label']),
+                      ('connectors', lambda connector: (connector['source'], connector['destination']))):
+        old = {item['id']: key(item) for item in getattr(old_graph, kind, [])}
+        new = {item['id']: key(item) for item in getattr(new_graph, kind, [])}
+
+        changes[kind] = {
+            'added': [item_id for item_id in new if item_id not in old],
+            'removed': [item_id for item_id in old if item_id not in new],
+            'changed': [item_id for item_id, value in new.items() if item_id in old and old[item_id] != value]
+        }
+
+    return changes
+
+
+# Return True if there are any differences in the topology_changes
+def has_topology_changes(changes):
+    return any(ids for kind in changes.values() for ids in kind.values())
+
+
+# Return a one line summary of the topology_changes, such as "2 shapes added, 1 connector changed"
+def format_topology_changes(changes):
+    parts = []
+    for kind, by_change in changes.items():
+        for change, ids in by_change.items():
+            if ids:
+                parts.append(f"{len(ids)} {kind if len(ids) > 1 else kind[:-1]} {change}")
+
+    return ", ".join(parts) if parts else "no changes"
+
+
+# An ODF file being watched, along with the .dot file written for it and the graph that was last scanned from it
+class _watched_file:
+
+    def __init__(self, odf_file_name, spec_filename):
+        self.odf_file_name = odf_file_name
+        self.spec_filename = spec_filename
+
+        # The modification time and size of the file when it was last looked at, and when that was first seen
+        self.seen = None
+        self.seen_since = None
+
+        # The modification time and size of the file when it was last scanned, and what was scanned from it
+        self.scanned = None
+        self.graph = None
+
+    # Return the modification time and size of the file, or None if it doesn't exist
+    def status(self):
+        import os
+
+        try:
+            status = os.stat(self.odf_file_name)
+        except FileNotFoundError:
+            return None
+        return status.st_mtime_ns, status.st_size
+
+    # Scan the file again, and rewrite the .dot file if the topology has changed since the last scan. The .dot file
+    # is written to a temporary file which then replaces it, so that anything watching it never sees half a file.
+    # Returns the topology_changes, or None if there weren't any
+    def refresh(self, streaming_ingest=True, all_pages=False, **options):
+        graph = network_graph()
+        scan_diagram(self.odf_file_name, graph, streaming_ingest, all_pages=all_pages)
+
+        changes = topology_changes(self.graph, graph)
+        if self.graph is not None and not has_topology_changes(changes):
+            return None
+
+        with _replacing_file(self.spec_filename) as text_file:
+            write_graph_to(graph, text_file, **options)
+
+        self.graph = graph
+        return changes
+
+
+# Watch ODF files for changes and regenerate their .dot files as they are saved. outputs maps the name of each ODF
+# file to the name of the .dot file to write for it. The files are polled every interval seconds, and a file is only
+# read once it has stopped changing for settle seconds, so that a save in progress isn't read half written. Only
+# content.xml is read again, and the shapes and connectors found are compared with those read last time: the .dot
+# file is only rewritten when the topology has changed. Every .dot file is written once at the start. A file that
+# can't be read is reported and tried again when it next changes. Any options are passed on to scan_diagram and
+# write_graph_to. This is a generator that runs until it is closed, yielding the (ODF file, topology_changes) of
+# every .dot file written
+def watch_files(outputs, interval=0.5, settle=0.5, **options):
+    import time
+
+    watched = [_watched_file(odf_file_name, spec_filename) for odf_file_name, spec_filename in outputs.items()]
+
+    while True:
+        now = perf_counter()
+        for watched_file in watched:
+            status = watched_file.status()
+            if status != watched_file.seen:
+                watched_file.seen, watched_file.seen_since = status, now
+                continue
+
+            if status is None or status == watched_file.scanned or now - watched_file.seen_since < settle:
+                continue
+
+            watched_file.scanned = status
+            try:
+                changes = watched_file.refresh(**options)
+            except Exception as e:
+                logger.warning("Failed to convert %s: %s", watched_file.odf_file_name, e)
+                continue
+
+            if changes is not None:
+                yield watched_file.odf_file_name, changes
+            else:
+                logger.info("%s was saved without changing the topology", watched_file.odf_file_name)
+
+        time.sleep(interval)
+
+
+# Command line entry point. Converts the ODF file named on the command line and writes the graphviz specification
+# to the output file ('-' writes it to standard output). When several files (or glob patterns) are named, or an
+# output directory is given, they are converted as a batch, each to its own .dot file. With --watch, it keeps
+# running and regenerates the .dot files as the presentations are edited. With --render, the .dot files are also
+# laid out into images by Graphviz
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a network diagram drawn in an open document format "
+                                                 "(ODF) presentation into a graphviz (.dot) specification")
+    parser.add_argument("inputs", nargs="*", metavar="input", default=["FourNodeExample.odp"],
+                        help="the ODF presentation to convert, or several presentations or glob patterns to convert "
+                             "as a batch (default: FourNodeExample.odp)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="the .dot file to write, or - for standard output (default: specification.dot)")
+    parser.add_argument("--output-dir", default=None,
+                        help="convert as a batch, writing each .dot file into this directory instead of alongside "
+                             "its presentation")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes for a batch (default: one per CPU)")
+    parser.add_argument("--no-streaming", dest="streaming_ingest", action="store_false",
+                        help="read the whole document into memory before scanning it, instead of streaming it")
+    parser.add_argument("--all-pages", action="store_true",
+                        help="merge the diagrams on every page into one network graph, instead of reading only the "
+                             "first page")
+    parser.add_argument("--no-merge-networks", dest="merge_networks", action="store_false",
+                        help="keep each drawn network shape as a separate network, instead of joining those with the "
+                             "same name into one")
+    parser.add_argument("--clusters", action="store_true",
+                        help="draw each VM in a cluster along with its ports")
+    parser.add_argument("--focus", metavar="NAME=VALUE", default=None,
+                        help="only write the neighbourhood of the VMs, ports or networks whose label has this "
+                             "name=value pair, such as name=web01")
+    parser.add_argument("--hops", type=int, default=1,
+                        help="how many edges away from the focus the neighbourhood reaches (default: %(default)s)")
+    parser.add_argument("--split-components", action="store_true",
+                        help="write each connected component of the diagram to its own .dot file, named after the "
+                             "output file with the number of the component added, so that they can be laid out "
+                             "separately")
+    parser.add_argument("--validate", action="store_true",
+                        help="check each whole diagram first, reporting every problem found, and only convert the "
+                             "ones with no errors")
+    parser.add_argument("--validate-only", action="store_true",
+                        help="check the whole diagram and report every problem found, without converting it")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory of the cache of converted files (default: $XDG_CACHE_HOME/odf_to_graphviz)")
+    parser.add_argument("--cache-size", type=float, default=256,
+                        help="maximum size of the cache in MiB; the least recently used entries are evicted beyond "
+                             "it (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always convert, neither reading nor updating the cache")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="empty the caches of converted files and rendered images before converting")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running, and regenerate the .dot files whenever the topology of the diagrams in "
+                             "the presentations changes")
+    parser.add_argument("--watch-interval", type=float, default=0.5,
+                        help="seconds between checks for changes when watching (default: %(default)s)")
+    parser.add_argument("--render", action="append", choices=["svg", "png", "pdf"],
+                        help="also render each .dot file into an image in this format with Graphviz, which can be "
+                             "given more than once")
+    parser.add_argument("--engine", default="dot",
+                        choices=["dot", "neato", "fdp", "sfdp", "circo", "twopi", "osage", "patchwork"],
+                        help="the Graphviz layout engine to render with (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="report the steps of the conversion (-v), or trace everything read and generated (-vv)")
+    parser.add_argument("--stats", nargs="?", const="table", choices=["table", "json"],
+                        help="report the time and peak memory of each step, and counts of what was found, "
+                             "on standard error as a table (the default) or as JSON")
+    args = parser.parse_args(argv)
+
+    # Quiet unless asked otherwise: warnings only, the step banners with -v, and the full trace with -vv
+    log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
+    logging.basicConfig(level=log_levels[min(args.verbose, len(log_levels) - 1)], format="%(message)s")
+
+    # Unchanged presentations are taken from the cache unless it is switched off
+    if args.no_cache:
+        args.cache_dir = None
+    elif args.cache_dir is None:
+        from conversion_cache import default_cache_dir
+        args.cache_dir = default_cache_dir()
+    args.cache_max_bytes = int(args.cache_size * 1024 * 1024)
+
+    if args.clear_cache:
+        import os
+        from conversion_cache import conversion_cache, default_cache_dir
+        from render_graphviz import render_cache
+
+        cache_dir = args.cache_dir if args.cache_dir is not None else default_cache_dir()
+        conversion_cache(cache_dir).clear()
+        render_cache(os.path.join(cache_dir, "renders")).clear()
+
+    inputs = expand_input_paths(args.inputs)
+
+    # With --validate, the inputs with errors are left out, and the rest are converted
+    invalid = set()
+    if args.validate or args.validate_only:
+        invalid = run_validate(inputs, args)
+        if args.validate_only:
+            return 1 if invalid else 0
+
+    if len(inputs) > 1 or args.output_dir is not None:
+        if args.output is not None:
+            parser.error("-o/--output can only be used when converting a single file; use --output-dir for a batch")
+        if args.split_components:
+            parser.error("--split-components can only be used when converting a single file")
+        if args.watch:
+            if len(invalid) == len(inputs):
+                return 1
+            return run_watch({odf_file_name: batch_output_path(odf_file_name, args.output_dir)
+                              for odf_file_name in inputs if odf_file_name not in invalid}, args)
+        return run_batch(inputs, args, invalid)
+
+    if invalid:
+        return 1
+
+    if args.output == "-" and (args.watch or args.render or args.split_components):
+        parser.error("--watch, --render and --split-components need a .dot file to write to, not standard output")
+
+    if args.watch:
+        if args.split_components:
+            parser.error("--split-components can't be used with --watch")
+        return run_watch({inputs[0]: args.output if args.output is not None else "specification.dot"}, args)
+
+    stats = conversion_stats(trace_memory=args.stats is not None)
+    try:
+        spec_filename = args.output if args.output is not None else "specification.dot"
+        # =======================================================================
+        logger.info("STEP 5: Write the graphviz data to file '%s' as it is generated", spec_filename)
+        # =======================================================================
+
+        if args.split_components:
+            spec_filenames = convert_components(inputs[0], spec_filename, stats=stats, **conversion_options(args))
+            sys.stderr.write(f"Wrote {len(spec_filenames)} components\n")
+        else:
+            spec_filenames = [spec_filename]
+
+            # The .dot file is written as it is generated, replacing the old one only once it is complete
+            if spec_filename == "-":
+                convert_file_to(inputs[0], sys.stdout, args, stats)
+            else:
+                with _replacing_file(spec_filename) as text_file:
+                    convert_file_to(inputs[0], text_file, args, stats)
+    finally:
+        stats.close()
+
+    if args.stats == "json":
+        import json
+        sys.stderr.write(json.dumps(stats.as_dict(), indent=2) + "\n")
+    elif args.stats == "table":
+        sys.stderr.write(stats.format_table())
+
+    return run_render(spec_filenames, args)
+
+
+# Return the options for convert_to chosen on the command line
+def conversion_options(args):
+    return {
+        'streaming_ingest': args.streaming_ingest,
+        'all_pages': args.all_pages,
+        'merge_networks': args.merge_networks,
+        'clusters': args.clusters,
+        'focus': args.focus,
+        'hops': args.hops
+    }
+
+
+# Convert a single file for the command line, writing the .dot file to a text sink, through the cache unless it is
+# switched off
+def convert_file_to(odf_file_name, sink, args, stats):
+    cache = open_cache(args.cache_dir, args.cache_max_bytes)
+    if cache is not None:
+        convert_cached_to(odf_file_name, sink, cache, stats=stats, **conversion_options(args))
+    else:
+        convert_to(odf_file_name, sink, stats=stats, **conversion_options(args))
+
+
+# Convert the files of a batch for the command line, reporting a summary of any failures once they are all done.
+# The files in invalid, which failed validation, are not converted but are listed among the failures
+def run_batch(inputs, args, invalid=()):
+    started = perf_counter()
+    converted, failures = convert_batch([odf_file_name for odf_file_name in inputs if odf_file_name not in invalid],
+                                        output_dir=args.output_dir, jobs=args.jobs, cache_dir=args.cache_dir,
+                                        cache_max_bytes=args.cache_max_bytes, **conversion_options(args))
+    failures = [(odf_file_name, "not converted, as validation found errors in it")
+                for odf_file_name in inputs if odf_file_name in invalid] + failures
+
+    sys.stderr.write(f"Converted {len(converted)} of {len(inputs)} files in {perf_counter() - started:.2f}s\n")
+    if failures:
+        sys.stderr.write(f"{len(failures)} failed:\n")
+        for odf_file_name, message in failures:
+            sys.stderr.write(f"  {odf_file_name}: {message}\n")
+
+    render_failed = run_render([spec_filename for _, spec_filename in converted], args)
+    return 1 if failures or render_failed else 0
+
+
+# Watch the files for the command line, reporting each .dot file written, until interrupted
+def run_watch(outputs, args):
+    import os
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    sys.stderr.write(f"Watching {len(outputs)} file{'s' if len(outputs) > 1 else ''}, press Ctrl-C to stop\n")
+    try:
+        for odf_file_name, changes in watch_files(outputs, interval=args.watch_interval,
+                                                  settle=args.watch_interval, **conversion_options(args)):
+            sys.stderr.write(f"Wrote {outputs[odf_file_name]} for {odf_file_name}: "
+                             f"{format_topology_changes(changes)}\n")
+            run_render([outputs[odf_file_name]], args)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+# Validate the files for the command line, reporting the problems found in each: on standard output when only
+# validating, and on standard error when validating before converting. Returns the set of the files that have
+# errors (or can't be read at all)
+def run_validate(inputs, args):
+    report = sys.stdout if args.validate_only else sys.stderr
+
+    invalid = set()
+    for odf_file_name in inputs:
+        heading = f"{odf_file_name}:\n" if len(inputs) > 1 else ""
+        try:
+            diagnostics = validate_odf_file(odf_file_name, args.streaming_ingest, all_pages=args.all_pages)
+        except Exception as e:
+            report.write(f"{heading}error: {odf_file_name} could not be read: {e}\n")
+            invalid.add(odf_file_name)
+            continue
 
-# =========================================================================
-print("STEP 4: BUILD UP THE TEXT OF THE GRAPHVIZ FILE FROM COLLECTED INFO")
-# =========================================================================
+        if diagnostics or args.validate_only:
+            report.write(heading + format_diagnostics(diagnostics))
+        if any(item['severity'] == "error" for item in diagnostics):
+            invalid.add(odf_file_name)
 
-# Add the header
-result = ""
-result += add_dot_header()
+    return invalid
 
-# Add the networks and ports
-result += add_non_network_graphviz_nodes(non_network_nodes)
 
-# Add the unlabelled edges that connect vm's to ports that they own
-result += add_non_network_graphviz_edges(non_network_edges, scanned_shapes)
+# Render the .dot files written for the command line into the image formats asked for with --render, using a render
+# cache alongside the cache of converted files. Returns 1 if any of them failed to render, and 0 otherwise
+def run_render(spec_filenames, args):
+    if not args.render:
+        return 0
 
-# Add the labelled edges that represent networks that connect ports to other ports
-result += add_network_graphviz_edges(network_connectors)
-result += add_dot_closer()
+    import os
+    from render_graphviz import render_files
 
-# Show the results file
-print(f"\nAutomatically generated graphviz specification:\n\n{result}")
-print("")
+    render_cache_dir = os.path.join(args.cache_dir, "renders") if args.cache_dir is not None else None
+    rendered, failures = render_files(spec_filenames, args.render, args.engine, args.jobs, render_cache_dir,
+                                      args.cache_max_bytes)
 
-spec_filename = "specification.dot"
-# =======================================================================
-print(f"STEP 5: Write the graphviz data to file '{spec_filename}'")
-# =======================================================================
+    for dot_file_name, image_file_name in rendered:
+        logger.info("Rendered %s to %s", dot_file_name, image_file_name)
+    for dot_file_name, message in failures:
+        sys.stderr.write(f"Failed to render {dot_file_name}: {message}\n")
 
-# Save the file
-with open(spec_filename, "wt") as text_file:
-    text_file.write(result)
+    return 1 if failures else 0
 
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import shutil
+import sys
+import threading
+
+from conversion_cache import conversion_cache, default_cache_dir, DEFAULT_MAX_BYTES
+
+
+# Renders .dot files into SVG, PNG or PDF images with a locally installed Graphviz layout engine. Laying out a large
+# graph is by far the slowest part of getting from a presentation to a picture, so every render is cached, keyed on
+# a hash of the .dot text, the layout engine and the output format: a topology that has already been laid out is
+# copied from the cache instead of being laid out again. When there are several images to render, the engines are
+# run side by side, and identical renders among them are only run once.
+
+
+OUTPUT_FORMATS = ("svg", "png", "pdf")
+
+LAYOUT_ENGINES = ("dot", "neato", "fdp", "sfdp", "circo", "twopi", "osage", "patchwork")
+
+
+# Return the key of a render of the given .dot text (as bytes) laid out by the given engine in the given format
+def render_key(dot_data, engine, output_format):
+    digest = hashlib.sha256(f"{engine}|{output_format}|".encode("utf-8"))
+    digest.update(dot_data)
+    return digest.hexdigest()
+
+
+# Return the default directory of the render cache, alongside the cache of converted files
+def default_render_cache_dir():
+    return os.path.join(default_cache_dir(), "renders")
+
+
+# A cache of rendered images, kept in the same way as the cache of converted files (see conversion_cache.py)
+class render_cache(conversion_cache):
+
+    suffix = ".render"
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory if directory is not None else default_render_cache_dir(), max_bytes)
+
+    # Return the cache key for the given .dot text (as bytes) laid out by the given engine in the given format
+    def key_for_dot(self, dot_data, engine, output_format):
+        return render_key(dot_data, engine, output_format)
+
+    # Copy the image stored under the key to the named file and return True, or return False if there isn't one. A
+    # hit marks the entry as recently used
+    def fetch(self, key, output_file_name):
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output_file_name)
+        except FileNotFoundError:
+            if not os.path.exists(path):
+                self.misses += 1
+                return False
+            raise
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return True
+
+    # Store a copy of the named image file under the key
+    def store(self, key, rendered_file_name):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(rendered_file_name, temp_path)
+        os.replace(temp_path, path)
+        self.evict()
+
+
+# Return the name of the image to write for a .dot file: the same name with the extension of the format
+def render_output_path(dot_file_name, output_format):
+    return os.path.splitext(dot_file_name)[0] + "." + output_format
+
+
+# Render the named .dot file into an image in the given format, written to output_file_name, using the named
+# Graphviz layout engine. The image is taken from the render cache in cache_dir if the same .dot text has been
+# rendered the same way before, and stored there if not; no cache is used if cache_dir is None. Returns the name of
+# the image written
+def render_dot_file(dot_file_name, output_file_name, output_format="svg", engine="dot", cache_dir=None,
+                    cache_max_bytes=None):
+    import subprocess
+
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"Can't render to {output_format}, only to {', '.join(OUTPUT_FORMATS)}")
+    if engine not in LAYOUT_ENGINES:
+        raise Exception(f"Unknown Graphviz layout engine {engine}")
+
+    cache = None
+    if cache_dir is not None:
+        cache = render_cache(cache_dir, cache_max_bytes if cache_max_bytes is not None else DEFAULT_MAX_BYTES)
+        with open(dot_file_name, "rb") as dot_file:
+            key = cache.key_for_dot(dot_file.read(), engine, output_format)
+        if cache.fetch(key, output_file_name):
+            return output_file_name
+
+    # The engine writes to a temporary file, so that a failed render never leaves half an image behind
+    temp_file_name = f"{output_file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        try:
+            result = subprocess.run([engine, f"-T{output_format}", "-o", temp_file_name, dot_file_name],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise Exception(f"The Graphviz {engine} command wasn't found; is Graphviz installed?")
+        if result.returncode != 0:
+            raise Exception(f"{engine} failed to render {dot_file_name}: "
+                            f"{result.stderr.decode('utf-8', 'replace').strip()}")
+
+        if cache is not None:
+            cache.store(key, temp_file_name)
+        os.replace(temp_file_name, output_file_name)
+    finally:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
+
+    return output_file_name
+
+
+# Render each of the named .dot files into each of the given formats, alongside the .dot file. The layout engines
+# are run side by side, at most jobs at a time (None uses one per CPU); as the work is done by the engines in their
+# own processes, threads are enough to keep them busy. .dot files with the same text are only laid out once in each
+# format, and the image copied for the rest. A render that fails does not stop the rest. Returns a list of the
+# (.dot file, image) pairs rendered and a list of the (.dot file, error message) pairs that failed
+def render_files(dot_file_names, output_formats=("svg",), engine="dot", jobs=None, cache_dir=None,
+                 cache_max_bytes=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    rendered = []
+    failures = []
+
+    # Group the renders by their key, so that each group is laid out once
+    renders = {}
+    for dot_file_name in dot_file_names:
+        try:
+            with open(dot_file_name, "rb") as dot_file:
+                dot_data = dot_file.read()
+        except OSError as e:
+            failures.extend((dot_file_name, str(e)) for _ in output_formats)
+            continue
+
+        for output_format in output_formats:
+            renders.setdefault(render_key(dot_data, engine, output_format), []).append(
+                (dot_file_name, render_output_path(dot_file_name, output_format), output_format))
+
+    with ThreadPoolExecutor(max_workers=jobs if jobs is not None else os.cpu_count()) as pool:
+        futures = []
+        for group in renders.values():
+            dot_file_name, output_file_name, output_format = group[0]
+            futures.append((pool.submit(render_dot_file, dot_file_name, output_file_name, output_format, engine,
+                                        cache_dir, cache_max_bytes), group))
+
+        for future, group in futures:
+            try:
+                image_file_name = future.result()
+            except Exception as e:
+                failures.extend((dot_file_name, str(e)) for dot_file_name, _, _ in group)
+                continue
+
+            rendered.append((group[0][0], image_file_name))
+            for dot_file_name, output_file_name, _ in group[1:]:
+                try:
+                    if output_file_name != image_file_name:
+                        shutil.copyfile(image_file_name, output_file_name)
+                    rendered.append((dot_file_name, output_file_name))
+                except OSError as e:
+                    failures.append((dot_file_name, str(e)))
+
+    return rendered, failures
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render graphviz (.dot) files into images with a local Graphviz, "
+                                                 "caching the results")
+    parser.add_argument("inputs", nargs="+", metavar="input", help="the .dot files to render")
+    parser.add_argument("-T", "--format", dest="formats", action="append", choices=OUTPUT_FORMATS,
+                        help="an image format to render, which can be given more than once (default: svg)")
+    parser.add_argument("--engine", default="dot", choices=LAYOUT_ENGINES,
+                        help="the Graphviz layout engine (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of renders to run at once (default: one per CPU)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory of the render cache (default: $XDG_CACHE_HOME/odf_to_graphviz/renders)")
+    parser.add_argument("--no-cache", action="store_true", help="always render, neither reading nor updating "
+                                                                 "the cache")
+    args = parser.parse_args(argv)
+
+    cache_dir = None if args.no_cache else (args.cache_dir or default_render_cache_dir())
+    rendered, failures = render_files(args.inputs, args.formats or ["svg"], args.engine, args.jobs, cache_dir)
+
+    for _, output_file_name in rendered:
+        print(output_file_name)
+    for dot_file_name, message in failures:
+        print(f"{dot_file_name}: {message}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
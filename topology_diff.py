@@ -0,0 +1,201 @@
+import json
+import sys
+
+import powerpoint_to_graphviz as converter
+
+
+# Compares the network diagrams in two revisions of a presentation, and reports the VMs, ports and networks that
+# have been added, removed, relabelled or re-wired, and the connections that have been added or removed. Objects are
+# matched by their name=, falling back to their draw:id for shapes without one, in the same way as the nodes of the
+# .dot file are named. Shapes that share a name are treated as one object, as networks drawn more than once are
+# merged into one. Everything is compared through dictionaries and sets, so the comparison takes time in proportion
+# to the size of the diagrams.
+
+
+# Colours used for the changes in the .dot file of differences
+ADDED_COLOUR = "green4"
+REMOVED_COLOUR = "red"
+CHANGED_COLOUR = "orange"
+UNCHANGED_COLOUR = "gray40"
+
+
+# Return the name an object is matched on: its name=, or its draw:id if it doesn't have one
+def object_key(shape):
+    name = converter.get_object_parameter(shape, "name")
+    return name if name is not None else shape['id']
+
+
+# Scan the diagram in an ODF file (a file name or binary file object) into a network_graph
+def load_graph(odf_file, all_pages=False):
+    graph = converter.network_graph()
+    converter.scan_diagram(odf_file, graph, all_pages=all_pages)
+    return graph
+
+
+# Return the topology of a graph as a dictionary of its objects, keyed by the name they are matched on, and a set of
+# its connections, each a sorted tuple of the names of the two objects joined. The ends of connectors that aren't
+# attached to a shape are named by the draw:id they refer to
+def graph_topology(graph):
+    objects = {}
+    for shape in graph.shapes:
+        objects.setdefault(object_key(shape), shape)
+
+    edges = set()
+    for connector in graph.connectors:
+        source, dest = converter.get_source_and_dest(connector, graph, allow_missing=True)
+        source_key = object_key(source) if source is not None else connector['source']
+        dest_key = object_key(dest) if dest is not None else connector['destination']
+        edges.add(tuple(sorted((source_key, dest_key))))
+
+    return objects, edges
+
+
+# Return the neighbours of each object joined by the connections
+def neighbours_of(edges):
+    neighbours = {}
+    for first, second in edges:
+        neighbours.setdefault(first, set()).add(second)
+        neighbours.setdefault(second, set()).add(first)
+
+    return neighbours
+
+
+# Compare two graphs and return the differences as a dictionary of:
+#
+#   - 'added_nodes', 'removed_nodes': the names of the objects only found in the new or the old graph
+#   - 'changed_nodes': the objects found in both whose labels differ, each as {'name', 'old_label', 'new_label'}
+#   - 'rewired_nodes': the objects found in both whose connections differ, each as {'name', 'connected',
+#     'disconnected'} listing the names of the objects they have been connected to and disconnected from
+#   - 'added_edges', 'removed_edges': the connections only found in the new or the old graph, as pairs of names
+#
+# Every list is sorted, so the same two graphs always give the same result
+def diff_graphs(old_graph, new_graph):
+    old_objects, old_edges = graph_topology(old_graph)
+    new_objects, new_edges = graph_topology(new_graph)
+    old_neighbours = neighbours_of(old_edges)
+    new_neighbours = neighbours_of(new_edges)
+
+    changed_nodes = []
+    rewired_nodes = []
+    for key in sorted(old_objects.keys() & new_objects.keys()):
+        old_label = converter.tidy_text(old_objects[key]['label'])
+        new_label = converter.tidy_text(new_objects[key]['label'])
+        if old_label != new_label:
+            changed_nodes.append({'name': key, 'old_label': old_label, 'new_label': new_label})
+
+        before = old_neighbours.get(key, set())
+        after = new_neighbours.get(key, set())
+        if before != after:
+            rewired_nodes.append({'name': key, 'connected': sorted(after - before),
+                                  'disconnected': sorted(before - after)})
+
+    return {
+        'added_nodes': sorted(new_objects.keys() - old_objects.keys()),
+        'removed_nodes': sorted(old_objects.keys() - new_objects.keys()),
+        'changed_nodes': changed_nodes,
+        'rewired_nodes': rewired_nodes,
+        'added_edges': sorted(new_edges - old_edges),
+        'removed_edges': sorted(old_edges - new_edges)
+    }
+
+
+# Return True if the diff_graphs result has any differences
+def has_differences(diff):
+    return any(diff.values())
+
+
+# Return the differences as human-readable text, one change per line
+def format_diff(diff):
+    lines = []
+    for name in diff['added_nodes']:
+        lines.append(f"+ node {name}")
+    for name in diff['removed_nodes']:
+        lines.append(f"- node {name}")
+    for node in diff['changed_nodes']:
+        lines.append(f"~ node {node['name']}: label {node['old_label']!r} -> {node['new_label']!r}")
+    for node in diff['rewired_nodes']:
+        wiring = [f"+{name}" for name in node['connected']] + [f"-{name}" for name in node['disconnected']]
+        lines.append(f"~ node {node['name']}: re-wired {' '.join(wiring)}")
+    for first, second in diff['added_edges']:
+        lines.append(f"+ edge {first} -- {second}")
+    for first, second in diff['removed_edges']:
+        lines.append(f"- edge {first} -- {second}")
+
+    return "\n".join(lines) + "\n" if lines else "no differences\n"
+
+
+# Write a .dot file of both graphs together to a text sink, with the objects and connections that have been added
+# drawn in green, those removed in red and dashed, and objects that have been relabelled or re-wired in orange.
+# Networks are drawn as nodes, so that a port moved from one network to another shows up as one connection removed
+# and another added
+def write_diff_dot(old_graph, new_graph, diff, sink):
+    old_objects, old_edges = graph_topology(old_graph)
+    new_objects, new_edges = graph_topology(new_graph)
+
+    added_nodes = set(diff['added_nodes'])
+    removed_nodes = set(diff['removed_nodes'])
+    changed_nodes = {node['name'] for node in diff['changed_nodes']} | {node['name'] for node in diff['rewired_nodes']}
+
+    writer = converter.dot_writer(sink)
+    writer.write(converter.add_dot_header())
+
+    for key, shape in {**old_objects, **new_objects}.items():
+        style = ""
+        if key in added_nodes:
+            colour = ADDED_COLOUR
+        elif key in removed_nodes:
+            colour, style = REMOVED_COLOUR, ", style = dashed"
+        elif key in changed_nodes:
+            colour = CHANGED_COLOUR
+        else:
+            colour = UNCHANGED_COLOUR
+        writer.write(f'  "{converter.escape_dot_text(key)}"[shape = {shape["shape"]}, '
+                     f'label = "{converter.get_dot_label(shape)}", color = {colour}{style}]\n')
+
+    for first, second in sorted(old_edges | new_edges):
+        if (first, second) not in old_edges:
+            attributes = f"color = {ADDED_COLOUR}"
+        elif (first, second) not in new_edges:
+            attributes = f"color = {REMOVED_COLOUR}, style = dashed"
+        else:
+            attributes = f"color = {UNCHANGED_COLOUR}"
+        writer.write(f'  "{converter.escape_dot_text(first)}" -- "{converter.escape_dot_text(second)}"'
+                     f'[{attributes}]\n')
+
+    writer.write(converter.add_dot_closer())
+    writer.flush()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the network diagrams in two revisions of an ODF "
+                                                 "presentation")
+    parser.add_argument("old", help="the earlier revision of the presentation")
+    parser.add_argument("new", help="the later revision of the presentation")
+    parser.add_argument("--json", action="store_true", help="print the differences as JSON")
+    parser.add_argument("--dot", metavar="FILE",
+                        help="also write a .dot file of both diagrams with the differences colour-coded")
+    parser.add_argument("--all-pages", action="store_true",
+                        help="compare the diagrams on every page, instead of only the first")
+    args = parser.parse_args(argv)
+
+    old_graph = load_graph(args.old, args.all_pages)
+    new_graph = load_graph(args.new, args.all_pages)
+    diff = diff_graphs(old_graph, new_graph)
+
+    if args.json:
+        print(json.dumps(diff, indent=2))
+    else:
+        sys.stdout.write(format_diff(diff))
+
+    if args.dot:
+        with open(args.dot, "wt") as text_file:
+            write_diff_dot(old_graph, new_graph, diff, text_file)
+
+    # Like diff, exit with 1 when there are differences
+    return 1 if has_differences(diff) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())